@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+Part = Tuple[Any, Any]  # (update, context)
+
+class AlbumBuffer:
+    # Telegram delivers an album as separate messages that share a
+    # media_group_id. Parts are collected per user and group until none has
+    # arrived for `window` seconds, then handed to `commit` together.
+    def __init__(self, window: float, commit: Callable[[int, List[Part]], Awaitable[None]]):
+        self.window = window
+        self.commit = commit
+        self.albums: Dict[Tuple[int, str], List[Part]] = {}
+        self.timers: Dict[Tuple[int, str], asyncio.TimerHandle] = {}
+        self.tasks: Dict[int, Set[asyncio.Task]] = {}
+
+    def add(self, user_id: int, group_id: str, update, context):
+        key = (user_id, group_id)
+        self.albums.setdefault(key, []).append((update, context))
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[key] = asyncio.get_running_loop().call_later(self.window, self._expire, key)
+
+    def _expire(self, key: Tuple[int, str]):
+        task = asyncio.create_task(self._flush(key))
+        tasks = self.tasks.setdefault(key[0], set())
+        tasks.add(task)
+        task.add_done_callback(lambda task: self._done(key[0], task))
+
+    def _done(self, user_id: int, task: asyncio.Task):
+        tasks = self.tasks.get(user_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.tasks[user_id]
+
+    async def _flush(self, key: Tuple[int, str]):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        parts = self.albums.pop(key, None)
+        if parts:
+            await self.commit(key[0], parts)
+
+    async def flush_user(self, user_id: int):
+        # Commits the user's albums now, e.g. before converting or adding a
+        # later message, and waits for the user's commits already under way.
+        await asyncio.gather(*[self._flush(key) for key in list(self.albums) if key[0] == user_id])
+        tasks = self.tasks.get(user_id)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def discard_user(self, user_id: int):
+        for key in [key for key in self.albums if key[0] == user_id]:
+            self.timers.pop(key).cancel()
+            del self.albums[key]
+
+    def pending(self) -> int:
+        return sum(len(parts) for parts in self.albums.values())
+
+    async def shutdown(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        self.albums.clear()
+        tasks = [task for user_tasks in self.tasks.values() for task in user_tasks]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
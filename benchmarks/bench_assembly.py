@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+from typing import Dict, Any, List
+
+from PIL import Image
+
+from pdf_builder import build_pdf, generate_item_pdf, merge_pdfs
+
+# Run from the repository root:
+#   python -m benchmarks.bench_assembly --items 200
+# Every variant runs in its own interpreter so peak RSS is not shared.
+
+def make_items(count: int) -> List[Dict[str, Any]]:
+    items = []
+    for i in range(count):
+        if i % 2 == 0:
+            text = "\n".join(f"Line {n} of message {i}: lorem ipsum dolor sit amet " * 2 for n in range(15))
+            items.append({"type": "text", "content": text})
+        else:
+            img = Image.new("RGB", (1600, 1200), ((i * 37) % 255, (i * 11) % 255, 120))
+            bio = BytesIO()
+            img.save(bio, format="JPEG", quality=85)
+            bio.seek(0)
+            items.append({"type": "photo", "content": bio})
+    return items
+
+def run_legacy(items: List[Dict[str, Any]]) -> BytesIO:
+    pdf_list = [generate_item_pdf(item) for item in items]
+    return asyncio.run(merge_pdfs(pdf_list))
+
+def run_single_pass(items: List[Dict[str, Any]]) -> BytesIO:
+    output, _ = build_pdf(items)
+    return output
+
+VARIANTS = {
+    "legacy": run_legacy,
+    "single_pass": run_single_pass,
+}
+
+def run_variant(name: str, count: int) -> Dict[str, Any]:
+    items = make_items(count)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    output = VARIANTS[name](items)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "variant": name,
+        "items": count,
+        "wall_s": round(elapsed, 3),
+        "peak_rss_kb": peak_rss,
+        "rss_growth_kb": peak_rss - base_rss,
+        "output_bytes": len(output.getvalue()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--variant", choices=sorted(VARIANTS))
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.items)))
+        return
+
+    results = []
+    for name in VARIANTS:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_assembly", "--items", str(args.items), "--variant", name],
+            capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(proc.stdout))
+    for r in results:
+        print(f"{r['variant']:>12}: {r['wall_s']:.3f}s  peak RSS {r['peak_rss_kb'] / 1024:.1f} MB "
+              f"(+{r['rss_growth_kb'] / 1024:.1f} MB)  output {r['output_bytes'] / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
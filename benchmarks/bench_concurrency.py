@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder
+from telegram.request import BaseRequest
+
+from benchmarks.bench_pipeline import git_commit
+from concurrency import UserOrderedApplication
+
+# Run from the repository root:
+#   python -m benchmarks.bench_concurrency
+#   python -m benchmarks.bench_concurrency --users 1 10 100 --latency 0.05
+# Feeds many simulated users through the real handlers and Application
+# (fake Telegram API with a fixed latency per call, no updater) and reports
+# throughput and ordering for each mode:
+#   sequential  one update at a time, as before
+#   concurrent  plain concurrent_updates, no per-user ordering
+#   per_user    UserOrderedApplication, as main.py runs it
+# Each user, already in the accumulating step of the conversation, picks a
+# language and sends numbered text messages. A user is in order when the
+# session holds exactly those texts in the order they were sent and the bot
+# answered with the same messages as for a lone user processed sequentially.
+
+MODES = ["sequential", "concurrent", "per_user"]
+RESULTS_DIR = os.path.join("benchmarks", "results")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PDFGenius", "username": "pdfgenius_bench_bot"}
+
+class FakeTelegram(BaseRequest):
+    # Answers every Bot API call after `latency` seconds, as a remote
+    # server would, so handlers spend their time awaiting like in production.
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.message_id = 0
+        self.replies: Dict[int, List[str]] = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint == "getMe":
+            result = BOT_USER
+        else:
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            parameters = request_data.parameters if request_data else {}
+            chat_id = int(parameters.get("chat_id", parameters.get("callback_query_id", 0)))
+            self.message_id += 1
+            self.replies.setdefault(chat_id, []).append(f"{endpoint}:{parameters.get('text', '')}")
+            result = {"message_id": self.message_id, "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER,
+                      "text": parameters.get("text", "")}
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def make_update(bot, update_id: int, user_id: int, text: str = None, data: str = None) -> Update:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    if data is not None:
+        # A press on the inline language keyboard under an earlier bot message.
+        message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "👋"}
+        query = {"id": str(user_id), "from": user, "chat_instance": str(user_id), "data": data, "message": message}
+        return Update.de_json({"update_id": update_id, "callback_query": query}, bot)
+    message = {"message_id": update_id, "date": int(time.time()), "text": text, "chat": chat, "from": user}
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+def build(mode: str, request: FakeTelegram, concurrency: int) -> Application:
+    import main
+    builder = ApplicationBuilder().token(main.BOT_TOKEN).request(request).updater(None)
+    if mode == "concurrent":
+        builder = builder.concurrent_updates(concurrency)
+    elif mode == "per_user":
+        builder = builder.application_class(UserOrderedApplication).concurrent_updates(concurrency)
+    application = builder.build()
+    main.add_handlers(application)
+    return application
+
+async def run_mode(mode: str, users: int, messages: int, latency: float, concurrency: int,
+                   first_user: int, expected_replies: List[str] = None) -> Dict[str, Any]:
+    import main
+    request = FakeTelegram(latency)
+    application = build(mode, request, concurrency)
+    await application.initialize()
+    await application.start()
+    user_ids = [first_user + n for n in range(users)]
+    sent = {user_id: [f"message {n}" for n in range(messages)] for user_id in user_ids}
+    # Users interleave: everyone's language choice, then everyone's first
+    # message and so on.
+    updates = []
+    for user_id in user_ids:
+        main.conv_handler._conversations[(user_id, user_id)] = main.STATE_ACCUMULATE
+        updates.append(make_update(application.bot, len(updates) + 1, user_id, data="lang_kz"))
+    for step in range(messages):
+        for user_id in user_ids:
+            updates.append(make_update(application.bot, len(updates) + 1, user_id, sent[user_id][step]))
+
+    start = time.perf_counter()
+    for update in updates:
+        await application.update_queue.put(update)
+    await application.update_queue.join()
+    while getattr(application, "user_updates", None):
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+
+    await application.stop()
+    await application.shutdown()
+    in_order = 0
+    for user_id in user_ids:
+        texts = [item["content"] for item in main.sessions.items(user_id) if item["type"] == "text"]
+        replies = request.replies.get(user_id, [])
+        in_order += texts == sent[user_id] and replies == (expected_replies or replies)
+        main.sessions.drop(user_id)
+        del main.conv_handler._conversations[(user_id, user_id)]
+    return {"mode": mode, "users": users, "updates": len(updates), "api_calls": request.calls,
+            "elapsed_s": round(elapsed, 3), "updates_per_s": round(len(updates) / elapsed, 1),
+            "users_in_order": in_order, "replies": request.replies.get(user_ids[0], [])}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="*", choices=MODES, default=MODES)
+    parser.add_argument("--users", nargs="*", type=int, default=[1, 10, 50])
+    parser.add_argument("--messages", type=int, default=5, help="text messages per user after /start")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per Bot API call")
+    parser.add_argument("--concurrency", type=int, help="concurrent_updates (default: main.CONCURRENT_UPDATES)")
+    parser.add_argument("--json", help="where to write the results (default: benchmarks/results/concurrency_<commit>.json)")
+    args = parser.parse_args()
+
+    state = tempfile.mkdtemp(prefix="bench-concurrency-")
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["DB_FILE"] = os.path.join(state, "bench.db")
+    os.environ["SPOOL_DIR"] = os.path.join(state, "spool")
+    os.environ["MEDIA_CACHE_DIR"] = os.path.join(state, "cache")
+    os.environ["METRICS_PORT"] = "0"
+    import main as bot_main
+    bot_main.setup()
+    concurrency = args.concurrency or bot_main.CONCURRENT_UPDATES
+
+    results: List[Dict[str, Any]] = []
+
+    async def run_all():
+        reference = await run_mode("sequential", 1, args.messages, 0, concurrency, 1000)
+        first_user = 1001
+        for users in args.users:
+            for mode in args.modes:
+                result = await run_mode(mode, users, args.messages, args.latency, concurrency, first_user,
+                                        reference["replies"])
+                first_user += users
+                del result["replies"]
+                results.append(result)
+                print(f"{mode:<11} users={users:<4} {result['updates_per_s']:>8.1f} updates/s  "
+                      f"{result['elapsed_s']:>7.2f} s  in order {result['users_in_order']}/{users}")
+        await bot_main.post_shutdown(None)
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        shutil.rmtree(state, ignore_errors=True)
+
+    for users in args.users:
+        rates = {r["mode"]: r["updates_per_s"] for r in results if r["users"] == users}
+        if "sequential" in rates and "per_user" in rates:
+            print(f"users={users:<4} per_user is {rates['per_user'] / rates['sequential']:.1f}x sequential")
+
+    commit = git_commit()
+    path = args.json or os.path.join(RESULTS_DIR, f"concurrency_{commit}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "python": sys.version.split()[0], "latency_s": args.latency, "messages": args.messages,
+                   "concurrency": concurrency, "results": results}, f, indent=2)
+    print(f"\nresults written to {path}")
+
+if __name__ == "__main__":
+    main()
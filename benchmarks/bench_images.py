@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from typing import Dict, Any, List
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from pdf_builder import IMAGE_DPI, JPEG_QUALITY, build_pdf
+
+# Run from the repository root:
+#   python -m benchmarks.bench_images --photos 12
+# Compares the previous decode/resize/encode/re-encode photo path with the
+# current one on synthetic phone photos. Every variant runs in its own
+# interpreter so peak RSS is not shared.
+
+PHOTO_SHAPES = [
+    ("12mp_landscape", (4000, 3000), "JPEG"),
+    ("12mp_portrait", (3000, 4000), "JPEG"),
+    ("screenshot", (1080, 2340), "PNG"),
+    ("messenger", (1280, 960), "JPEG"),
+    ("thumbnail", (480, 360), "JPEG"),
+]
+
+def make_photo(size, fmt: str, seed: int) -> bytes:
+    # A gradient with sensor-like noise compresses roughly like a real photo.
+    w, h = size
+    gradient = Image.linear_gradient("L").resize((w, h))
+    noise = Image.effect_noise((w, h), 24 + seed % 8)
+    img = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    bio = BytesIO()
+    if fmt == "JPEG":
+        img.save(bio, format=fmt, quality=88)
+    else:
+        img.save(bio, format=fmt)
+    return bio.getvalue()
+
+def write_corpus(directory: str, count: int):
+    for i in range(count):
+        _, size, fmt = PHOTO_SHAPES[i % len(PHOTO_SHAPES)]
+        with open(os.path.join(directory, f"{i:04d}.img"), "wb") as f:
+            f.write(make_photo(size, fmt, i))
+
+def load_items(directory: str) -> List[Dict[str, Any]]:
+    items = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as f:
+            items.append({"type": "photo", "content": BytesIO(f.read())})
+    return items
+
+def legacy_build(items: List[Dict[str, Any]]) -> BytesIO:
+    # The photo path as it was before the zero-recompression pipeline.
+    from reportlab import rl_config
+    rl_config.useA85 = 1
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    for item in items:
+        item["content"].seek(0)
+        img = Image.open(item["content"])
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        available_width = A4[0] - 80
+        available_height = A4[1] - 80
+        img_width, img_height = img.size
+        scale = min(1.0, available_width / img_width, available_height / img_height)
+        new_width = int(img_width * scale)
+        new_height = int(img_height * scale)
+        compressed = BytesIO()
+        img_resized = img.resize((new_width, new_height), Image.LANCZOS) if scale < 1.0 else img
+        img_resized.save(compressed, format="JPEG", quality=90, optimize=True)
+        compressed.seek(0)
+        c.drawImage(ImageReader(Image.open(compressed)), (A4[0] - new_width) / 2,
+                    (A4[1] - new_height) / 2, width=new_width, height=new_height)
+        c.showPage()
+    c.save()
+    return buffer
+
+def current_build(items: List[Dict[str, Any]], dpi: int) -> BytesIO:
+    output, _ = build_pdf(items, dpi, JPEG_QUALITY)
+    return output
+
+def run_variant(name: str, corpus: str, dpi: int) -> Dict[str, Any]:
+    items = load_items(corpus)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    output = legacy_build(items) if name == "legacy" else current_build(items, dpi)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "variant": name if name == "legacy" else f"{name}@{dpi}dpi",
+        "photos": len(items),
+        "input_bytes": sum(len(item["content"].getvalue()) for item in items),
+        "wall_s": round(elapsed, 3),
+        "peak_rss_kb": peak_rss,
+        "rss_growth_kb": peak_rss - base_rss,
+        "output_bytes": len(output.getvalue()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--dpi", type=int, nargs="*", default=[72, IMAGE_DPI])
+    parser.add_argument("--variant", choices=["legacy", "pipeline"])
+    parser.add_argument("--corpus")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.corpus, args.dpi[0])))
+        return
+
+    with tempfile.TemporaryDirectory() as corpus:
+        write_corpus(corpus, args.photos)
+        runs = [("legacy", args.dpi[0])] + [("pipeline", dpi) for dpi in args.dpi]
+        for name, dpi in runs:
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_images", "--corpus", corpus,
+                 "--variant", name, "--dpi", str(dpi)],
+                capture_output=True, text=True, check=True
+            )
+            r = json.loads(proc.stdout)
+            print(f"{r['variant']:>16}: {r['wall_s']:.3f}s  peak RSS {r['peak_rss_kb'] / 1024:.1f} MB "
+                  f"(+{r['rss_growth_kb'] / 1024:.1f} MB)  output {r['output_bytes'] / 1024:.0f} KB "
+                  f"(input {r['input_bytes'] / 1024:.0f} KB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Dict, Any, List
+
+import fitz  # PyMuPDF
+
+from benchmarks.bench_images import make_photo
+
+# Run from the repository root:
+#   python -m benchmarks.bench_pipeline
+#   python -m benchmarks.bench_pipeline --scenarios text photos --compare benchmarks/results/<old>.json
+# Drives the per-item functions and the full handler flow (fake Update and
+# Context objects, a stub bot, local files instead of Telegram downloads) on a
+# synthetic corpus. Every (scenario, target) pair runs in its own interpreter
+# so peak RSS is not shared. For the flow, latency is per incoming update and
+# convert_ms is the time from the filename answer to the delivered document.
+# Results are written as JSON for comparison between commits.
+
+SCENARIOS = ["text", "photos", "pdf100", "pdf500"]
+TARGETS = ["generate_item_pdf", "merge_pdfs", "convert_pdf_item_to_images", "flow"]
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+# --- Corpus ---
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua. Сәлем, әлем! Привет, мир! 📄 ")
+
+def write_pdf(path: str, pages: int):
+    with fitz.open() as doc:
+        for n in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"Page {n + 1}\n\n" + LOREM * 12)
+            page.draw_rect(fitz.Rect(50, 700, 250, 780), color=(0.2, 0.3, 0.8), fill=(0.8, 0.85, 1))
+        doc.save(path, garbage=1, deflate=True)
+
+def write_corpus(directory: str, scenario: str, photos: int, messages: int):
+    if scenario == "text":
+        with open(os.path.join(directory, "messages.json"), "w") as f:
+            json.dump([(LOREM * (3 + i % 20)).strip() for i in range(messages)], f)
+    elif scenario == "photos":
+        for i in range(photos):
+            shape = (4000, 3000) if i % 2 == 0 else (3000, 4000)
+            with open(os.path.join(directory, f"photo_{i:03d}.jpg"), "wb") as f:
+                f.write(make_photo(shape, "JPEG", i))
+    else:
+        write_pdf(os.path.join(directory, f"{scenario}.pdf"), int(scenario[3:]))
+
+def corpus_files(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+def load_items(directory: str) -> List[Dict[str, Any]]:
+    items = []
+    for path in corpus_files(directory):
+        if path.endswith(".json"):
+            with open(path) as f:
+                items += [{"type": "text", "content": text} for text in json.load(f)]
+            continue
+        with open(path, "rb") as f:
+            data = BytesIO(f.read())
+        items.append({"type": "pdf" if path.endswith(".pdf") else "photo", "content": data})
+    return items
+
+# --- Per-item functions ---
+def legacy_item_pdfs(items: List[Dict[str, Any]], samples: List[float]) -> List[BytesIO]:
+    # The per-item path draws uploaded PDFs as one photo per page.
+    from pdf_builder import convert_pdf_item_to_images, generate_item_pdf
+    pdfs = []
+    for item in items:
+        start = time.perf_counter()
+        if item["type"] == "pdf":
+            for img in convert_pdf_item_to_images(item["content"]):
+                pdfs.append(generate_item_pdf({"type": "photo", "content": img}))
+        else:
+            pdfs.append(generate_item_pdf(item))
+        samples.append(time.perf_counter() - start)
+    return pdfs
+
+def run_generate_item_pdf(items: List[Dict[str, Any]], samples: List[float]) -> int:
+    pdfs = legacy_item_pdfs(items, samples)
+    return sum(len(pdf.getvalue()) for pdf in pdfs)
+
+def run_merge_pdfs(items: List[Dict[str, Any]], samples: List[float]) -> int:
+    from pdf_builder import merge_pdfs
+    pdfs = legacy_item_pdfs(items, [])
+    start = time.perf_counter()
+    output = asyncio.run(merge_pdfs(pdfs))
+    samples.append(time.perf_counter() - start)
+    return len(output.getvalue())
+
+def run_convert_pdf_item_to_images(items: List[Dict[str, Any]], samples: List[float]) -> int:
+    from pdf_builder import convert_pdf_item_to_images
+    total = 0
+    for item in items:
+        if item["type"] != "pdf":
+            continue
+        start = time.perf_counter()
+        images = convert_pdf_item_to_images(item["content"])
+        samples.append(time.perf_counter() - start)
+        total += sum(len(img.getvalue()) for img in images)
+    return total
+
+# --- Handler flow ---
+class FakeFile:
+    def __init__(self, path: str):
+        self.file_path = path
+
+    async def download_to_drive(self, custom_path: str):
+        shutil.copyfile(self.file_path, custom_path)
+
+class FakeDocument:
+    def __init__(self, path: str, unique_id: str):
+        self.path = path
+        self.file_name = os.path.basename(path)
+        self.file_size = os.path.getsize(path)
+        self.file_unique_id = unique_id
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self.path)
+
+class FakeMessage:
+    def __init__(self, chat, text: str = None, document: FakeDocument = None):
+        self.chat = chat
+        self.chat_id = chat.user_id
+        self.text = text
+        self.caption = None
+        self.document = document
+        self.photo = []
+        self.media_group_id = None
+
+    async def reply_text(self, text: str, **kwargs):
+        self.chat.replies += 1
+
+    def get_bot(self) -> "StubBot":
+        return StubBot()
+
+class FakeChat:
+    # Stands in for the bot side of one user's chat.
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.replies = 0
+        self.output_bytes = 0
+
+    def update(self, message: FakeMessage) -> SimpleNamespace:
+        return SimpleNamespace(effective_user=SimpleNamespace(id=self.user_id),
+                               effective_chat=SimpleNamespace(id=self.user_id),
+                               message=message, callback_query=None)
+
+class StubBot:
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return SimpleNamespace(chat_id=chat_id, message_id=0)
+
+class StubUploader:
+    # Counts the delivered bytes instead of sending them.
+    def __init__(self, chat: FakeChat):
+        self.chat = chat
+        self.volumes = 0
+
+    async def send_document(self, bot, chat_id: int, path: str, filename: str, caption: str = None):
+        self.chat.output_bytes += os.path.getsize(path)
+        self.volumes += 1
+        return {}
+
+async def drive_flow(directory: str, samples: List[float], extra: Dict[str, Any]) -> int:
+    import main
+    main.setup()
+    chat = FakeChat(user_id=1000)
+    main.uploader = StubUploader(chat)
+    context = SimpleNamespace(bot=StubBot(), user_data={}, chat_data={}, bot_data={})
+    messages = []
+    for path in corpus_files(directory):
+        if path.endswith(".json"):
+            with open(path) as f:
+                messages += [FakeMessage(chat, text=text) for text in json.load(f)]
+        else:
+            # Unique per run so the media cache does not hide the work.
+            unique_id = f"{os.path.basename(path)}-{time.time_ns()}"
+            messages.append(FakeMessage(chat, document=FakeDocument(path, unique_id)))
+    for message in messages:
+        start = time.perf_counter()
+        await main.accumulate_handler(chat.update(message), context)
+        samples.append(time.perf_counter() - start)
+    trans = main.load_translations(main.get_user_lang(chat.user_id))
+    await main.accumulate_handler(chat.update(FakeMessage(chat, text=f"📄 {trans['btn_convert_pdf']}")), context)
+    start = time.perf_counter()
+    await main.ask_filename_handler(chat.update(FakeMessage(chat, text="❌ Жоқ")), context)
+    await main.scheduler.wait_idle()
+    extra["convert_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    extra["volumes"] = main.uploader.volumes
+    main.render_backend.shutdown()
+    return chat.output_bytes
+
+def run_flow(directory: str, samples: List[float], extra: Dict[str, Any]) -> int:
+    state = tempfile.mkdtemp(prefix="bench-state-")
+    os.environ.update({
+        "DB_FILE": os.path.join(state, "bench.db"),
+        "SPOOL_DIR": os.path.join(state, "spool"),
+        "MEDIA_CACHE_DIR": os.path.join(state, "cache"),
+    })
+    try:
+        return asyncio.run(drive_flow(directory, samples, extra))
+    finally:
+        shutil.rmtree(state, ignore_errors=True)
+
+# --- Measurement ---
+def peak_rss_kb() -> int:
+    # ru_maxrss survives fork and exec on Linux, so a child would report the
+    # parent's peak from writing the corpus. VmHWM belongs to this process.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def count_units(directory: str) -> int:
+    # Messages and photos count one each, uploaded PDFs count their pages.
+    units = 0
+    for path in corpus_files(directory):
+        if path.endswith(".json"):
+            with open(path) as f:
+                units += len(json.load(f))
+        elif path.endswith(".pdf"):
+            with fitz.open(path) as doc:
+                units += doc.page_count
+        else:
+            units += 1
+    return units
+
+def run_target(target: str, scenario: str, directory: str) -> Dict[str, Any]:
+    samples: List[float] = []
+    extra: Dict[str, Any] = {}
+    base_rss = peak_rss_kb()
+    start = time.perf_counter()
+    if target == "flow":
+        output_bytes = run_flow(directory, samples, extra)
+    else:
+        items = load_items(directory)
+        start = time.perf_counter()
+        output_bytes = globals()[f"run_{target}"](items, samples)
+    elapsed = time.perf_counter() - start
+    peak_rss = peak_rss_kb()
+    units = count_units(directory)
+    return {
+        "scenario": scenario,
+        "target": target,
+        "units": units,
+        "wall_s": round(elapsed, 3),
+        "items_per_s": round(units / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+        "samples": len(samples),
+        "peak_rss_kb": peak_rss,
+        "rss_growth_kb": peak_rss - base_rss,
+        "output_bytes": output_bytes,
+        **extra,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def compare(results: List[Dict[str, Any]], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["target"]): r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["scenario"], r["target"]))
+        if old is None:
+            continue
+        changes = []
+        for key in ("items_per_s", "p95_ms", "peak_rss_kb", "output_bytes"):
+            if old[key]:
+                changes.append(f"{key} {100 * (r[key] - old[key]) / old[key]:+.1f}%")
+        print(f"{r['scenario']:>8} {r['target']:<27} " + "  ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="*", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--targets", nargs="*", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--photos", type=int, default=6)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--json", help="where to write the results (default: benchmarks/results/pipeline_<commit>.json)")
+    parser.add_argument("--compare", help="an earlier results file to compare with")
+    parser.add_argument("--run", nargs=3, metavar=("TARGET", "SCENARIO", "CORPUS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        target, scenario, directory = args.run
+        print(json.dumps(run_target(target, scenario, directory)))
+        return
+
+    results = []
+    for scenario in args.scenarios:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{scenario}-") as directory:
+            write_corpus(directory, scenario, args.photos, args.messages)
+            for target in args.targets:
+                if target == "convert_pdf_item_to_images" and not scenario.startswith("pdf"):
+                    continue
+                proc = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_pipeline", "--run", target, scenario, directory],
+                    capture_output=True, text=True, check=True
+                )
+                r = json.loads(proc.stdout.strip().splitlines()[-1])
+                results.append(r)
+                print(f"{scenario:>8} {target:<27} {r['items_per_s']:>8.2f} items/s  "
+                      f"p50 {r['p50_ms']:>8.1f} ms  p95 {r['p95_ms']:>8.1f} ms  "
+                      f"peak RSS {r['peak_rss_kb'] / 1024:>6.1f} MB  output {r['output_bytes'] / 1024:>8.0f} KB"
+                      + (f"  convert {r['convert_ms']:.0f} ms" if "convert_ms" in r else ""))
+
+    commit = git_commit()
+    path = args.json or os.path.join(RESULTS_DIR, f"pipeline_{commit}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "python": sys.version.split()[0], "results": results}, f, indent=2)
+    print(f"\nresults written to {path}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
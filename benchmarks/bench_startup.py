@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List
+
+# Run from the repository root:
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup --runs 10 --compare benchmarks/results/<old>.json
+# Measures cold start in fresh interpreters: importing main and setup()
+# (what a webhook worker pays before it can bind its port), the time until
+# the early-bound webhook port answers a health check, loading the renderer
+# in the background warm-up, and the first render with and without that
+# warm-up.
+# Also lists the heavy modules that importing main pulled in, which should
+# be none, and the slowest imports from -X importtime.
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+HEAVY_MODULES = ["fitz", "reportlab.pdfgen.canvas", "PIL.Image", "PyPDF2", "pdf_builder"]
+MODES = ["warm", "cold"]
+
+# --- Child ---
+def run_child(mode: str, photo_path: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    import main
+    main.setup()
+    import_s = time.perf_counter() - start
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    async def first_response() -> float:
+        server = main.WebhookServer("/")
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port())
+        writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        await reader.readline()
+        elapsed = time.perf_counter() - start
+        writer.close()
+        await server.close()
+        return elapsed
+
+    async def first_render():
+        warm_up_s = 0.0
+        if mode == "warm":
+            start = time.perf_counter()
+            await main.render_backend.warm_up()
+            warm_up_s = time.perf_counter() - start
+        with open(photo_path, "rb") as f:
+            photo = main.sessions._spool(f.read())
+        items = [{"type": "text", "content": "Сәлем, әлем! 📄"},
+                 {"type": "photo", "content": photo}]
+        start = time.perf_counter()
+        path = os.path.join(main.SPOOL_DIR, "startup.pdf")
+        size, errors = await main.render_backend.render(items, main.IMAGE_DPI, main.JPEG_QUALITY, path)
+        render_s = time.perf_counter() - start
+        main.render_backend.shutdown()
+        assert size and not errors, errors
+        return warm_up_s, render_s
+
+    response_s = asyncio.run(first_response())
+    warm_up_s, render_s = asyncio.run(first_render())
+    return {"import_s": import_s, "response_s": response_s, "warm_up_s": warm_up_s, "render_s": render_s,
+            "heavy_loaded": loaded}
+
+# --- Parent ---
+def child_env(state: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": env.get("BOT_TOKEN", "0:bench"),
+        "DB_FILE": os.path.join(state, "bench.db"),
+        "SPOOL_DIR": os.path.join(state, "spool"),
+        "MEDIA_CACHE_DIR": os.path.join(state, "cache"),
+        "METRICS_PORT": "0",
+    })
+    return env
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict[str, Any]]:
+    # Cumulative time of the modules main imports directly.
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          capture_output=True, text=True, check=True, env=env)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    ") or name.strip() == "main":
+            if cumulative.strip().isdigit():
+                imports.append({"module": name.strip(), "ms": int(cumulative) / 1000})
+    imports.sort(key=lambda r: r["ms"], reverse=True)
+    return imports[:top]
+
+def compare(summary: Dict[str, Any], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    print(f"\ncompared with {baseline_path}:")
+    for key, value in summary.items():
+        old = baseline.get(key)
+        if old:
+            print(f"{key:<22} {100 * (value - old) / old:+.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to list")
+    parser.add_argument("--json", help="where to write the results (default: benchmarks/results/startup_<commit>.json)")
+    parser.add_argument("--compare", help="an earlier results file to compare with")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "PHOTO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_child(*args.run)))
+        return
+
+    from benchmarks.bench_images import make_photo
+    from benchmarks.bench_pipeline import git_commit, percentile
+
+    state = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        photo_path = os.path.join(state, "photo.jpg")
+        with open(photo_path, "wb") as f:
+            f.write(make_photo((3000, 4000), "JPEG", 1))
+        env = child_env(state)
+        runs = {mode: [] for mode in MODES}
+        for _ in range(args.runs):
+            for mode in MODES:
+                proc = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_startup", "--run", mode, photo_path],
+                    capture_output=True, text=True, check=True, env=env
+                )
+                runs[mode].append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        imports = slowest_imports(env, args.top)
+    finally:
+        shutil.rmtree(state, ignore_errors=True)
+
+    def median(mode: str, key: str) -> float:
+        return round(percentile([r[key] for r in runs[mode]], 0.5) * 1000, 1)
+
+    summary = {
+        "import_ms": median("cold", "import_s"),
+        "first_response_ms": median("cold", "response_s"),
+        "warm_up_ms": median("warm", "warm_up_s"),
+        "first_render_warm_ms": median("warm", "render_s"),
+        "first_render_cold_ms": median("cold", "render_s"),
+    }
+    heavy = sorted({name for r in runs["cold"] for name in r["heavy_loaded"]})
+    for key, value in summary.items():
+        print(f"{key:<22} {value:>8.1f} ms  (median of {args.runs})")
+    print(f"heavy modules after import: {', '.join(heavy) or 'none'}")
+    print("\nslowest imports of main:")
+    for r in imports:
+        print(f"  {r['module']:<32} {r['ms']:>8.1f} ms")
+
+    commit = git_commit()
+    path = args.json or os.path.join(RESULTS_DIR, f"startup_{commit}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "python": sys.version.split()[0], "summary": summary, "heavy_loaded": heavy,
+                   "imports": imports, "runs": runs}, f, indent=2)
+    print(f"\nresults written to {path}")
+    if args.compare:
+        compare(summary, args.compare)
+
+if __name__ == "__main__":
+    main()
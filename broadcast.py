@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import Dict
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from storage import Storage
+
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 5
+
+# --- Rate limiting ---
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # A flood wait applies to the whole bot, not to a single chat.
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.updated = self.paused_until
+        self.tokens = 0.0
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# --- Broadcast job ---
+class BroadcastJob:
+    def __init__(self, bot, storage: Storage, broadcast_id: int, rate: float,
+                 concurrency: int, progress_interval: float):
+        self.bot = bot
+        self.storage = storage
+        self.broadcast_id = broadcast_id
+        self.bucket = TokenBucket(rate, max(1, int(rate)))
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.broadcast = storage.get_broadcast(broadcast_id)
+        self.counts: Dict[str, int] = {"delivered": 0, "failed": 0, "blocked": 0}
+        self.total = 0
+
+    async def _send(self, user_id: int):
+        if self.broadcast["kind"] == "forward":
+            await self.bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=self.broadcast["from_chat_id"],
+                message_id=self.broadcast["message_id"]
+            )
+        else:
+            await self.bot.send_message(chat_id=user_id, text=f"[Админ хабарламасы]\n\n{self.broadcast['text']}")
+
+    async def deliver(self, user_id: int) -> str:
+        attempts = retry_after = 0
+        while attempts < MAX_ATTEMPTS:
+            await self.bucket.acquire()
+            try:
+                await self._send(user_id)
+                return "delivered"
+            except RetryAfter as e:
+                retry_after += 1
+                if retry_after > MAX_RETRY_AFTER:
+                    return "failed"
+                self.bucket.pause(e.retry_after)
+            except Forbidden:
+                return "blocked"
+            except BadRequest:
+                return "failed"
+            except NetworkError:
+                attempts += 1
+            except Exception:
+                return "failed"
+        return "failed"
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            status = await self.deliver(user_id)
+            self.storage.record_delivery(self.broadcast_id, user_id, status)
+            if status == "blocked":
+                self.storage.mark_blocked(user_id)
+            self.counts[status] += 1
+
+    def progress_text(self) -> str:
+        done = sum(self.counts.values())
+        return (
+            f"📢 Хабарлама жіберілуде: {done}/{self.total}\n"
+            f"✅ Жеткізілді: {self.counts['delivered']}\n"
+            f"❌ Қате: {self.counts['failed']}\n"
+            f"🚫 Ботты бұғаттаған: {self.counts['blocked']}"
+        )
+
+    def summary_text(self) -> str:
+        return (
+            f"🏁 Хабарлама жіберу аяқталды ({self.total} пайдаланушы).\n"
+            f"✅ Жеткізілді: {self.counts['delivered']}\n"
+            f"❌ Қате: {self.counts['failed']}\n"
+            f"🚫 Ботты бұғаттаған: {self.counts['blocked']}"
+        )
+
+    async def _report(self, progress, text: str):
+        try:
+            await self.bot.edit_message_text(chat_id=progress.chat_id, message_id=progress.message_id, text=text)
+        except Exception:
+            pass
+
+    async def run(self) -> Dict[str, int]:
+        # Deliveries that were recorded before a restart count towards the
+        # totals and are not sent again.
+        for status, count in self.storage.broadcast_summary(self.broadcast_id).items():
+            self.counts[status] = count
+        recipients = self.storage.broadcast_recipients(self.broadcast_id)
+        self.total = sum(self.counts.values()) + len(recipients)
+        admin_chat_id = self.broadcast["admin_chat_id"]
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in recipients:
+            queue.put_nowait(user_id)
+        progress = await self.bot.send_message(chat_id=admin_chat_id, text=self.progress_text())
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            last_text = None
+            pending = set(workers)
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=self.progress_interval)
+                text = self.progress_text()
+                if text != last_text:
+                    await self._report(progress, text)
+                    last_text = text
+        finally:
+            for worker in workers:
+                worker.cancel()
+        self.storage.finish_broadcast(self.broadcast_id)
+        await self.bot.send_message(chat_id=admin_chat_id, text=self.summary_text())
+        return self.counts
@@ -0,0 +1,46 @@
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from telegram.ext import Application
+
+def update_owner(update: Any) -> Optional[int]:
+    # Updates are ordered per user; those without one (channel posts, polls)
+    # per chat.
+    if not hasattr(update, "effective_user"):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+class UserOrderedApplication(Application):
+    # With concurrent_updates each update is processed in its own task. Here
+    # the first update of a user processes it and then every update of that
+    # user arriving meanwhile, in arrival order, while other users proceed in
+    # parallel. A user thus holds at most one of the concurrent slots and a
+    # busy user cannot starve the others.
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.user_updates: Dict[int, Deque[Any]] = {}
+
+    async def process_update(self, update: object) -> None:
+        owner = update_owner(update)
+        if owner is None:
+            await super().process_update(update)
+            return
+        pending = self.user_updates.get(owner)
+        if pending is not None:
+            pending.append(update)
+            return
+        pending = self.user_updates[owner] = deque([update])
+        try:
+            while pending:
+                await super().process_update(pending[0])
+                pending.popleft()
+        finally:
+            del self.user_updates[owner]
+
+    def stats(self) -> Dict[str, int]:
+        return {"users": len(self.user_updates),
+                "queued": sum(len(pending) - 1 for pending in self.user_updates.values())}
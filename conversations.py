@@ -0,0 +1,61 @@
+import pickle
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Tuple
+
+from telegram.ext import ConversationHandler
+from telegram.ext._conversationhandler import PendingState
+
+# PTB's own persistence loads conversations once at startup and writes them
+# back on an interval, so workers would never see each other's changes.
+# Instead the handler's state dict itself is kept in the session backend.
+
+class SharedConversations(MutableMapping):
+    # States of one ConversationHandler by conversation key. A state still
+    # being computed by a non-blocking callback (PendingState) holds a task
+    # and stays local to the worker running it.
+    def __init__(self, backend, name: str):
+        self.backend = backend
+        self.prefix = f"conversation:{name}:"
+        self.pending: Dict[Tuple[int, ...], PendingState] = {}
+
+    def _key(self, key: Tuple[int, ...]) -> str:
+        return self.prefix + ":".join(map(str, key))
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        data = self.backend.load(self._key(key))
+        if data is None:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def __setitem__(self, key, state: Any):
+        if isinstance(state, PendingState):
+            self.pending[key] = state
+            return
+        self.pending.pop(key, None)
+        self.backend.save(self._key(key), pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    def __delitem__(self, key):
+        found = self.pending.pop(key, None) is not None
+        with self.backend.transaction():
+            found = found or self.backend.load(self._key(key)) is not None
+            self.backend.delete(self._key(key))
+        if not found:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[Tuple[int, ...]]:
+        keys = set(self.pending)
+        for key in self.backend.keys(self.prefix):
+            keys.add(tuple(int(part) for part in key[len(self.prefix):].split(":")))
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return len(set(self))
+
+class SharedConversationHandler(ConversationHandler):
+    def __init__(self, *args, backend, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.name:
+            raise ValueError("Shared conversations need a name")
+        self._conversations = SharedConversations(backend, self.name)
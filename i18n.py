@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional
+
+# Reply keyboard buttons, mapped to the action they trigger.
+BUTTONS = {
+    "convert": ("📄", "btn_convert_pdf"),
+    "change_lang": ("🌐", "btn_change_lang"),
+    "help": ("❓", "btn_help"),
+}
+
+class TranslationCatalog:
+    def __init__(self, directory: str, languages: List[str], default_lang: str):
+        self.directory = directory
+        self.languages = languages
+        self.default_lang = default_lang
+        self.catalog: Dict[str, Dict[str, str]] = {}
+        self.buttons: Dict[str, Dict[str, str]] = {}
+        self.mtimes: Dict[str, float] = {}
+        self.load()
+
+    def _path(self, lang_code: str) -> str:
+        return os.path.join(self.directory, f"{lang_code}.json")
+
+    def _read(self, lang_code: str) -> Dict[str, str]:
+        path = self._path(lang_code)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.mtimes[lang_code] = os.path.getmtime(path)
+            return data
+        except (OSError, ValueError):
+            return {}
+
+    def load(self):
+        raw = {lang: self._read(lang) for lang in self.languages}
+        default = raw.get(self.default_lang, {})
+        catalog = {}
+        buttons = {}
+        for lang in self.languages:
+            # Keys missing from a language fall back to the default language.
+            trans = {**default, **raw[lang]}
+            catalog[lang] = trans
+            buttons[lang] = {f"{icon} {trans[key]}": action
+                             for action, (icon, key) in BUTTONS.items() if key in trans}
+        # Swap both tables at once so handlers never see a half-loaded catalog.
+        self.catalog, self.buttons = catalog, buttons
+
+    def get(self, lang_code: str) -> Dict[str, str]:
+        return self.catalog.get(lang_code) or self.catalog[self.default_lang]
+
+    def button_action(self, lang_code: str, text: str) -> Optional[str]:
+        buttons = self.buttons.get(lang_code) or self.buttons[self.default_lang]
+        return buttons.get(text)
+
+    def changed(self) -> bool:
+        for lang in self.languages:
+            try:
+                mtime = os.path.getmtime(self._path(lang))
+            except OSError:
+                continue
+            if mtime != self.mtimes.get(lang):
+                return True
+        return False
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self.changed():
+                self.load()
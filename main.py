@@ -1,18 +1,19 @@
 import os
-import json
-import textwrap
 import asyncio
+import functools
 import re
-from io import BytesIO
-from typing import Dict, Any, List
+import signal
+import tempfile
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
+from urllib.parse import urlparse
 
-import fitz  # PyMuPDF
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
     Message
 )
 from telegram.ext import (
@@ -22,25 +23,41 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     filters
 )
-from PIL import Image
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import ImageReader
-from PyPDF2 import PdfMerger
+
+from albums import AlbumBuffer
+from broadcast import BroadcastJob
+from concurrency import UserOrderedApplication
+from conversations import SharedConversationHandler
+from i18n import TranslationCatalog
+from media_cache import MediaCache
+from metrics import Metrics
+from downloads import Downloader
+from render_backend import create_render_backend
+from session_backend import create_session_backend
+from session_store import SessionStore, QuotaExceeded
+from scheduler import ConversionScheduler
+from size_planner import VOLUME_FILL, estimate_output, plan_render, render_within_budget
+from storage import Storage
+from uploads import Uploader
+from webhook import WebhookServer
 
 # --- Configuration ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = "5316060523"  # Өз админ ID-іңізді енгізіңіз
-STATS_FILE = "stats.json"
-USERS_FILE = "users.json"
+STATS_FILE = "stats.json"   # ескі формат, тек көшіру үшін
+USERS_FILE = "users.json"   # ескі формат, тек көшіру үшін
+DB_FILE = os.getenv("DB_FILE", "pdfgenius.db")
+STATS_FLUSH_INTERVAL = 5
 
 # --- Languages ---
 LANGUAGES = ["en", "kz", "ru", "uz", "tr", "ua"]
 DEFAULT_LANG = "en"
+TRANSLATIONS_DIR = "translations"
+TRANSLATIONS_WATCH = os.getenv("TRANSLATIONS_WATCH") == "1"  # аудармаларды қайта жүктеу (әзірлеу үшін)
+TRANSLATIONS_WATCH_INTERVAL = 5
 
 # --- Conversation states ---
 STATE_ACCUMULATE = 1
@@ -49,16 +66,78 @@ GET_FILENAME_INPUT = 3
 
 # --- Limits ---
 MAX_USER_FILE_SIZE = 20 * 1024 * 1024   # 20 MB
-MAX_OUTPUT_PDF_SIZE = 50 * 1024 * 1024  # 50 MB
+MAX_OUTPUT_PDF_SIZE = 50 * 1024 * 1024  # 50 MB, бір файлдың шегі
+MAX_OUTPUT_VOLUMES = int(os.getenv("MAX_OUTPUT_VOLUMES", 5))  # одан үлкен PDF бөліктерге бөлінеді
+
+# --- Broadcast ---
+BROADCAST_RATE = 25          # секундына хабарлама саны (Telegram шегі ~30)
+BROADCAST_CONCURRENCY = 10
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# --- Sessions ---
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "pdfgenius"))
+MAX_SESSION_BYTES = 200 * 1024 * 1024      # 200 MB
+MAX_SESSION_ITEMS = 500
+SESSION_IDLE_TTL = 6 * 60 * 60             # 6 сағат
+SESSION_SWEEP_INTERVAL = 10 * 60
+SESSION_BATCH_TTL = 3 * SESSION_SWEEP_INTERVAL  # тоқтаған worker-дің конвертациясы осыдан кейін қайтарылады
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" немесе "sqlite" (бірнеше worker үшін)
+SESSION_DB = os.getenv("SESSION_DB", os.path.join(SPOOL_DIR, "sessions.db"))
+# Бірнеше worker бір DB_FILE-ды бөліссе, тіл кэші осынша секундтан кейін жаңарады
+LANG_CACHE_TTL = 5.0 if SESSION_BACKEND == "sqlite" else None
+
+# --- Updates ---
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 64))  # бір уақытта өңделетін пайдаланушылар саны
+
+# --- Downloads ---
+ALBUM_WINDOW = 1.0   # альбомның келесі бөлігін күту уақыты (секунд)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 60
+UPLOAD_TIMEOUT = 300
+
+# --- Conversion queue ---
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", 2))
+CONVERSION_MEMORY_BUDGET = int(os.getenv("CONVERSION_MEMORY_BUDGET", 512 * 1024 * 1024))  # 512 MB
+MAX_QUEUED_CONVERSIONS = 20   # одан көп болса, жаңа файлдар қабылданбайды
+
+# --- Media cache ---
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", 2 * 1024 * 1024 * 1024))  # 2 GB
+
+# --- Rendering ---
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "thread")  # "thread" немесе "process"
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+IMAGE_DPI = int(os.getenv("IMAGE_DPI", 150))   # суреттердің және растрланған PDF беттерінің ажыратымдылығы
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", 20))          # бір worker-ге берілетін PDF беттері
+MAX_PAGES_IN_FLIGHT = int(os.getenv("MAX_PAGES_IN_FLIGHT", 100))  # бір уақытта өңделетін беттер шегі
+JPEG_QUALITY = 90
+
+# --- Metrics ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))   # 0 — өшірулі
+
+# --- Startup ---
+RENDER_WARMUP = os.getenv("RENDER_WARMUP", "1") == "1"  # PDF кітапханаларын іске қосылғаннан кейін фонда жүктеу
+WEBHOOK_EARLY_BIND = os.getenv("WEBHOOK_EARLY_BIND", "1") == "1"  # PORT-ты getMe-ден бұрын ашу (scale-to-zero үшін)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # X-Telegram-Bot-Api-Secret-Token, міндетті емес
 
 # --- Global data ---
-user_data: Dict[int, Dict[str, Any]] = {}
-
-# --- Register fonts ---
-try:
-    pdfmetrics.registerFont(TTFont('EmojiFont', 'fonts/Symbola.ttf'))
-except Exception:
-    pdfmetrics.registerFont(TTFont('EmojiFont', 'fonts/NotoSans.ttf'))
+# Created by setup(). The process render backend spawns workers that import
+# this module again, so importing it must not open databases or pools.
+storage: Storage = None
+catalog: TranslationCatalog = None
+downloader: Downloader = None
+albums: AlbumBuffer = None
+uploader: Uploader = None
+session_backend = None
+sessions: SessionStore = None
+media_cache: MediaCache = None
+metrics: Metrics = None
+scheduler: ConversionScheduler = None
+render_backend = None
+admin_conv_handler: SharedConversationHandler = None
+conv_handler: SharedConversationHandler = None
+background_tasks: List[asyncio.Task] = []
 
 # --- Sanitize filename ---
 def sanitize_filename(name: str) -> str:
@@ -70,139 +149,27 @@ def sanitize_filename(name: str) -> str:
 
 # --- Translation and helper functions ---
 def load_translations(lang_code: str) -> Dict[str, str]:
-    try:
-        with open(f"translations/{lang_code}.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        with open(f"translations/{DEFAULT_LANG}.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+    return catalog.get(lang_code)
 
 def get_user_lang(user_id: int) -> str:
-    if not os.path.exists(USERS_FILE):
-        return DEFAULT_LANG
-    try:
-        with open(USERS_FILE, "r") as f:
-            users = json.load(f)
-        return users.get(str(user_id), DEFAULT_LANG)
-    except Exception as e:
-        return DEFAULT_LANG
+    return storage.get_lang(user_id, DEFAULT_LANG)
 
 def save_user_lang(user_id: int, lang_code: str):
-    try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "r") as f:
-                users = json.load(f)
-        else:
-            users = {}
-    except Exception:
-        users = {}
-    users[str(user_id)] = lang_code
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f)
-
-def save_stats(action: str):
-    stats = {"total": 0, "items": 0, "pdf_count": 0}
-    try:
-        if os.path.exists(STATS_FILE):
-            with open(STATS_FILE, "r") as f:
-                stats = json.load(f)
-    except Exception:
-        pass
-    stats["total"] += 1
+    storage.set_lang(user_id, lang_code)
+
+def save_stats(action: str, count: int = 1):
+    storage.incr("total")
     if action == "item":
-        stats["items"] += 1
+        storage.incr("items", count)
     elif action == "pdf":
-        stats["pdf_count"] += 1
-    with open(STATS_FILE, "w") as f:
-        json.dump(stats, f)
+        storage.incr("pdf_count")
 
 def get_all_users() -> List[int]:
-    try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "r") as f:
-                users = json.load(f)
-            return [int(uid) for uid in users.keys()]
-        else:
-            return []
-    except Exception:
-        return []
+    return storage.user_ids()
 
-# --- PDF processing functions ---
-def convert_pdf_item_to_images(bio: BytesIO) -> List[BytesIO]:
-    images = []
-    try:
-        doc = fitz.open(stream=bio.getvalue(), filetype="pdf")
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap()
-            img_data = BytesIO(pix.tobytes("png"))
-            images.append(img_data)
-    except Exception as e:
-        return images
-    return images
-
-def generate_item_pdf(item: Dict[str, Any]) -> BytesIO:
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    c.setFont("EmojiFont", 12)
-    width, height = A4
-    if item["type"] == "text":
-        wrapped_text = []
-        for line in item["content"].split("\n"):
-            wrapped_text.extend(textwrap.wrap(line, width=80))
-        y_position = height - 50
-        for line in wrapped_text:
-            c.drawString(40, y_position, line)
-            y_position -= 20
-            if y_position < 50:
-                c.showPage()
-                c.setFont("EmojiFont", 12)
-                y_position = height - 50
-        c.showPage()
-    elif item["type"] == "photo":
-        try:
-            item["content"].seek(0)
-            img = Image.open(item["content"])
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            margin = 40
-            available_width = A4[0] - 2 * margin
-            available_height = A4[1] - 2 * margin
-            img_width, img_height = img.size
-            scale = min(1.0, available_width / img_width, available_height / img_height)
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            x = (A4[0] - new_width) / 2
-            y = (A4[1] - new_height) / 2
-            compressed = BytesIO()
-            if scale < 1.0:
-                img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-            else:
-                img_resized = img
-            img_resized.save(compressed, format="JPEG", quality=90, optimize=True)
-            compressed.seek(0)
-            comp_img = Image.open(compressed)
-            c.drawImage(ImageReader(comp_img), x, y, width=new_width, height=new_height)
-        except Exception as e:
-            c.drawString(40, height/2, f"😢 Error: {e}")
-        c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
-
-async def merge_pdfs(pdf_list: List[BytesIO]) -> BytesIO:
-    loop = asyncio.get_running_loop()
-    merger = PdfMerger()
-    for pdf_io in pdf_list:
-        try:
-            merger.append(pdf_io)
-        except Exception:
-            pass
-    output_buffer = BytesIO()
-    await loop.run_in_executor(None, merger.write, output_buffer)
-    merger.close()
-    output_buffer.seek(0)
-    return output_buffer
+async def mark_active(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user is not None:
+        storage.mark_active(update.effective_user.id)
 
 def get_effective_message(update: Update) -> Message:
     return update.message if update.message is not None else update.callback_query.message
@@ -213,7 +180,8 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang_code = get_user_lang(user_id)
     trans = load_translations(lang_code)
     save_user_lang(user_id, lang_code)
-    user_data[user_id] = {"items": [], "instruction_sent": False}
+    sessions.drop(user_id)
+    sessions.update(user_id)
     await update.message.reply_text(f"👋 {trans['welcome']}", reply_markup=language_keyboard())
     await update.message.reply_text(f"ℹ️ Бот басталды, user_id: {user_id}")
 
@@ -253,9 +221,11 @@ async def accumulate_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     lang_code = get_user_lang(user_id)
     trans = load_translations(lang_code)
     msg_text = update.message.text.strip() if update.message.text else ""
+    action = catalog.button_action(lang_code, msg_text)
     
-    if msg_text == f"📄 {trans['btn_convert_pdf']}":
-        items = user_data.get(user_id, {}).get("items", [])
+    if action == "convert":
+        await albums.flush_user(user_id)
+        items = sessions.items(user_id)
         if not items:
             await update.message.reply_text("⚠️ " + trans["no_items_error"])
             return STATE_ACCUMULATE
@@ -268,63 +238,241 @@ async def accumulate_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Задать название файла?", reply_markup=keyboard)
         return ASK_FILENAME
     
-    if msg_text == f"🌐 {trans['btn_change_lang']}":
+    if action == "change_lang":
         return await trigger_change_lang(update, context)
-    if msg_text == f"❓ {trans['btn_help']}":
+    if action == "help":
         return await trigger_help(update, context)
-    
+
+    message = update.message
+    if message.media_group_id and (message.photo or message.document):
+        albums.add(user_id, message.media_group_id, update, context)
+        return STATE_ACCUMULATE
+
+    # Albums sent before this message are added before it.
+    await albums.flush_user(user_id)
     await process_incoming_item(update, context)
-    if not user_data[user_id].get("instruction_sent", False):
+    if not sessions.get(user_id)["instruction_sent"]:
         await send_initial_instruction(update, context, lang_code)
-        user_data[user_id]["instruction_sent"] = True
+        sessions.update(user_id, instruction_sent=True)
     return STATE_ACCUMULATE
 
+def parse_page_range(text: str) -> Optional[Tuple[int, int]]:
+    # "5" or "3-10", 1-based and inclusive; returns 0-based pages.
+    match = re.fullmatch(r"\s*(\d+)\s*(?:[-–—]\s*(\d+))?\s*", text or "")
+    if not match:
+        return None
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    if first < 1 or last < first:
+        return None
+    return first - 1, last - 1
+
+def clamp_page_range(item: Dict[str, Any]) -> bool:
+    # Fits a requested range to the document; False when nothing of it is left.
+    if "from_page" not in item:
+        return True
+    if item["from_page"] >= item["page_count"]:
+        del item["from_page"], item["to_page"]
+        return False
+    item["to_page"] = min(item["to_page"], item["page_count"] - 1)
+    return True
+
+def describe_media(item_type: str, payload) -> Dict[str, Any]:
+    from pdf_builder import image_info, inspect_pdf
+
+    if item_type == "pdf":
+        return {"page_count": inspect_pdf(payload)}
+    width, height, fmt = image_info(payload)
+    return {"width": width, "height": height, "format": fmt}
+
+async def use_cache(method, *args):
+    # The cache only saves work: its failures are counted and otherwise
+    # treated as a miss, never as a failed item.
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    except Exception as e:
+        metrics.error("cache", type(e).__name__)
+        return None
+
+async def spool_download(user_id: int, item: Dict[str, Any], source, message: Message):
+    loop = asyncio.get_running_loop()
+    payload = item["content"]
+    item["unique_id"] = source.file_unique_id
+    key = MediaCache.key(source.file_unique_id)
+    stage = "download"
+    try:
+        meta = await use_cache(media_cache.fetch, key, payload.path)
+        if meta is None:
+            with metrics.timer(stage):
+                file_obj = await source.get_file()
+                await downloader.fetch(file_obj, payload.path)
+            stage = "inspect"
+            with metrics.timer(stage):
+                meta = await loop.run_in_executor(None, describe_media, item["type"], payload)
+            await use_cache(media_cache.store, key, payload.path, meta)
+        payload.size = os.path.getsize(payload.path)
+        metrics.incr("bytes_in_total", payload.size)
+        item.update(meta)
+        if item["type"] == "pdf" and item["page_count"] and not clamp_page_range(item):
+            await message.reply_text(f"⚠️ Құжатта {item['page_count']} бет бар, барлық беттер қосылды.")
+        if item["type"] == "pdf" and not item["page_count"]:
+            payload.discard()
+            item["type"] = "text"
+            item["content"] = f"📎 Файл қосылды: {item['file_name']}"
+            await message.reply_text("ℹ️ PDF өңделмеді, мәтін ретінде қосылды")
+    except Exception as e:
+        item["error"] = str(e)
+        metrics.error(stage, type(e).__name__)
+    else:
+        if item["type"] == "photo":
+            await prerender_photo(user_id, item)
+    finally:
+        item.pop("pending", None)
+        sessions.update_item(user_id, item)
+
+async def prerender_photo(user_id: int, item: Dict[str, Any]):
+    # Prepares the page image at the default settings while the user is
+    # still sending items, so converting only has to assemble the pages.
+    # Failures are left for the render itself to report.
+    key = MediaCache.key(item["unique_id"], "photo", IMAGE_DPI, JPEG_QUALITY)
+    try:
+        cached = await use_cache(media_cache.read, key)
+        if cached is not None:
+            data, meta = cached
+            rendered = (None if meta["source"] else data, tuple(meta["size"]), tuple(meta["display"]))
+        else:
+            from pdf_builder import prepare_photo
+
+            with metrics.timer("prerender"):
+                rendered = await render_backend.run(prepare_photo, item["content"], IMAGE_DPI, JPEG_QUALITY, False)
+            data, size, display = rendered
+            meta = {"source": data is None, "size": size, "display": display}
+            await use_cache(media_cache.store_bytes, key, data or b"", meta)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        metrics.error("prerender", type(e).__name__)
+        return
+    sessions.attach_render(user_id, item, (IMAGE_DPI, JPEG_QUALITY), *rendered)
+
+def queue_download(user_id: int, item: Dict[str, Any], source, message: Message):
+    sessions.track(item, asyncio.create_task(spool_download(user_id, item, source, message)))
+
+def file_spec(message: Message):
+    # (add_file arguments, Telegram file) for photos, images and PDFs, or
+    # None for documents that are only noted as text.
+    if message.photo:
+        photo = message.photo[-1]
+        return {"item_type": "photo", "size": photo.file_size or 0, "suffix": ".jpg",
+                "width": photo.width, "height": photo.height, "format": "JPEG"}, photo
+    doc = message.document
+    ext = os.path.splitext(doc.file_name or "")[1].lower()
+    if ext in [".jpg", ".jpeg", ".png", ".gif"]:
+        return {"item_type": "photo", "size": doc.file_size or 0, "suffix": ext}, doc
+    if ext == ".pdf":
+        # A caption such as "1-5" keeps only those pages.
+        spec = {"item_type": "pdf", "size": doc.file_size or 0, "suffix": ext, "file_name": doc.file_name}
+        pages = parse_page_range(message.caption)
+        if pages:
+            spec.update(from_page=pages[0], to_page=pages[1])
+        return spec, doc
+    return None
+
 async def process_incoming_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if "items" not in user_data.get(user_id, {}):
-        user_data[user_id] = {"items": [], "instruction_sent": False}
-    if update.message.text and not update.message.photo and not update.message.document:
-        item = {"type": "text", "content": update.message.text}
-        user_data[user_id]["items"].append(item)
-        await update.message.reply_text(f"ℹ️ Мәтін қосылды")
-    elif update.message.photo:
-        photo_file = await update.message.photo[-1].get_file()
-        bio = BytesIO()
-        await photo_file.download_to_memory(bio)
-        bio.seek(0)
-        item = {"type": "photo", "content": bio}
-        user_data[user_id]["items"].append(item)
-        await update.message.reply_text("ℹ️ Сурет қосылды")
-    elif update.message.document:
-        doc = update.message.document
-        if doc.file_size and doc.file_size > MAX_USER_FILE_SIZE:
-            await update.message.reply_text("⚠️ Файлдың өлшемі 20 MB-тан аспауы керек.")
-            return
-        ext = os.path.splitext(doc.file_name)[1].lower()
-        file_obj = await doc.get_file()
-        bio = BytesIO()
-        await file_obj.download_to_memory(bio)
-        bio.seek(0)
-        if ext in [".jpg", ".jpeg", ".png", ".gif"]:
-            item = {"type": "photo", "content": bio}
-            await update.message.reply_text("ℹ️ Сурет файлы қосылды")
-        elif ext == ".pdf":
-            images = convert_pdf_item_to_images(bio)
-            if images:
-                for img in images:
-                    item = {"type": "photo", "content": img}
-                    user_data[user_id]["items"].append(item)
-                await update.message.reply_text(f"ℹ️ PDF-тен {len(images)} сурет қосылды")
+    message = update.message
+    item = None
+    try:
+        if message.text and not message.photo and not message.document:
+            item = sessions.add_item(user_id, "text", message.text)
+            await message.reply_text(f"ℹ️ Мәтін қосылды")
+        elif message.photo or message.document:
+            doc = message.document
+            if doc and doc.file_size and doc.file_size > MAX_USER_FILE_SIZE:
+                await message.reply_text("⚠️ Файлдың өлшемі 20 MB-тан аспауы керек.")
+                return
+            found = file_spec(message)
+            if found is None:
+                item = sessions.add_item(user_id, "text", f"📎 Файл қосылды: {doc.file_name}")
+                await message.reply_text("ℹ️ Файл мәтін ретінде қосылды")
+            elif scheduler.saturated():
+                metrics.error("accept", "QueueFull")
+                await message.reply_text("⚠️ Сервер бос емес. Файлды сәл кейінірек қайта жіберіңіз.")
                 return
             else:
-                item = {"type": "text", "content": f"📎 Файл қосылды: {doc.file_name}"}
-                await update.message.reply_text("ℹ️ PDF өңделмеді, мәтін ретінде қосылды")
-        else:
-            item = {"type": "text", "content": f"📎 Файл қосылды: {doc.file_name}"}
-            await update.message.reply_text("ℹ️ Файл мәтін ретінде қосылды")
-        user_data[user_id]["items"].append(item)
+                spec, source = found
+                item = sessions.add_file(user_id, **spec)
+                queue_download(user_id, item, source, message)
+                if message.photo:
+                    await message.reply_text("ℹ️ Сурет қосылды")
+                elif item["type"] == "photo":
+                    await message.reply_text("ℹ️ Сурет файлы қосылды")
+                elif "from_page" in item:
+                    await message.reply_text(f"ℹ️ PDF қосылды ({item['from_page'] + 1}–{item['to_page'] + 1} беттер)")
+                else:
+                    await message.reply_text("ℹ️ PDF қосылды. Беттерді таңдау үшін файлға «1-5» сияқты жазба қосыңыз.")
+    except QuotaExceeded:
+        metrics.error("accept", "QuotaExceeded")
+        await message.reply_text("⚠️ Материалдар лимитіне жеттіңіз. Алдымен PDF жасаңыз немесе /cancel басыңыз.")
+        return
+    if item is not None:
+        metrics.incr("items_total", type=item["type"])
     save_stats("item")
 
+async def commit_album(user_id: int, parts: List[Tuple[Update, ContextTypes.DEFAULT_TYPE]]):
+    try:
+        await add_album(user_id, parts)
+    except Exception as e:
+        metrics.error("album", type(e).__name__)
+
+async def add_album(user_id: int, parts: List[Tuple[Update, ContextTypes.DEFAULT_TYPE]]):
+    # The parts of one album are added in a single write, downloaded
+    # concurrently and answered with one reply.
+    update, context = parts[0]
+    specs, sources, notes = [], [], []
+    too_large = 0
+    for part, _ in parts:
+        doc = part.message.document
+        if doc and doc.file_size and doc.file_size > MAX_USER_FILE_SIZE:
+            too_large += 1
+            continue
+        found = file_spec(part.message)
+        if found is None:
+            notes.append(f"📎 Файл қосылды: {doc.file_name}")
+            continue
+        specs.append(found[0])
+        sources.append((found[1], part.message))
+    refused = 0
+    if specs and scheduler.saturated():
+        refused = len(specs)
+        specs, sources = [], []
+        metrics.error("accept", "QueueFull")
+    items = sessions.add_files(user_id, specs)
+    for item, (source, message) in zip(items, sources):
+        queue_download(user_id, item, source, message)
+    try:
+        for note in notes:
+            items.append(sessions.add_item(user_id, "text", note))
+    except QuotaExceeded:
+        pass
+    for item in items:
+        metrics.incr("items_total", type=item["type"])
+
+    lines = [f"ℹ️ Альбомнан {len(items)} элемент қосылды"]
+    if too_large:
+        lines.append(f"⚠️ {too_large} файл 20 MB-тан үлкен, қосылмады.")
+    if refused:
+        lines.append(f"⚠️ Сервер бос емес, {refused} файл қосылмады. Сәл кейінірек қайта жіберіңіз.")
+    if len(items) < len(specs) + len(notes):
+        metrics.error("accept", "QuotaExceeded")
+        lines.append("⚠️ Материалдар лимитіне жеттіңіз. Алдымен PDF жасаңыз немесе /cancel басыңыз.")
+    await update.message.reply_text("\n".join(lines))
+    if items:
+        save_stats("item", len(items))
+    if not sessions.get(user_id)["instruction_sent"]:
+        await send_initial_instruction(update, context, get_user_lang(user_id))
+        sessions.update(user_id, instruction_sent=True)
+
 async def ask_filename_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang_code = get_user_lang(user_id)
@@ -358,60 +506,158 @@ async def filename_input_handler(update: Update, context: ContextTypes.DEFAULT_T
     return STATE_ACCUMULATE
 
 async def convert_pdf_handler_with_name(update: Update, context: ContextTypes.DEFAULT_TYPE, file_name: str):
+    # The items are handed to a scheduled job that sends the PDF itself, so
+    # other updates are not held up while the job waits for its turn.
     msg = get_effective_message(update)
     user_id = update.effective_user.id
     lang_code = get_user_lang(user_id)
     trans = load_translations(lang_code)
-    items = user_data.get(user_id, {}).get("items", [])
+    await albums.flush_user(user_id)
+    batch_id, items = sessions.take_items(user_id)
     if not items:
         await msg.reply_text("⚠️ " + trans["no_items_error"])
         return STATE_ACCUMULATE
+    weight = estimate_output(items, IMAGE_DPI, JPEG_QUALITY)
+    task = scheduler.spawn(user_id, conversion_job(msg, user_id, trans, batch_id, file_name, weight))
+    task.add_done_callback(lambda t: end_cancelled_job(t, user_id, batch_id))
+    return STATE_ACCUMULATE
+
+def end_cancelled_job(task: asyncio.Task, user_id: int, batch_id: str):
+    # A cancelled job may not have started yet. Items of a job cancelled by
+    # a shutdown are kept for the next start, those cancelled with /cancel
+    # go.
+    if not task.cancelled():
+        return
+    if scheduler.stopping:
+        sessions.restore_batch(user_id, batch_id)
+    else:
+        sessions.finish_batch(user_id, batch_id)
 
-    pdf_list = []
-    for i, item in enumerate(items):
+async def conversion_job(msg: Message, user_id: int, trans: Dict[str, str],
+                         batch_id: str, file_name: str, weight: int):
+    async def report_position(position: int):
+        await msg.reply_text(f"⏳ Кезекте #{position} орындасыз, PDF дайын болғанда жіберіледі.")
+
+    try:
+        async with scheduler.slot(user_id, weight, report_position):
+            delivered = await convert_items(msg, user_id, trans, batch_id, file_name)
+    except Exception as e:
+        metrics.error("conversion", type(e).__name__)
+        delivered = False
         try:
-            pdf_file = generate_item_pdf(item)
-            pdf_list.append(pdf_file)
-        except Exception as e:
-            await msg.reply_text(f"❌ {i+1}-ші элементті өңдеу қатесі: {e}")
+            await msg.reply_text("❌ PDF генерациясында қате шықты, қайта көріңіз.")
+        except Exception:
+            pass
+    if not delivered:
+        # Nothing was sent, the user can try again with the same items.
+        sessions.restore_batch(user_id, batch_id)
+        return
+    sessions.finish_batch(user_id, batch_id)
+    sessions.update(user_id, instruction_sent=False)
+    await msg.reply_text(
+        trans["instruction_initial"],
+        reply_markup=ReplyKeyboardMarkup(
+            [[f"📄 {trans['btn_convert_pdf']}"],
+             [f"🌐 {trans['btn_change_lang']}", f"❓ {trans['btn_help']}"]],
+            resize_keyboard=True
+        )
+    )
+
+def volume_name(file_name: str, number: int) -> str:
+    base, ext = os.path.splitext(file_name)
+    return f"{base}_part{number}{ext}"
+
+async def convert_items(msg: Message, user_id: int, trans: Dict[str, str], batch_id: str, file_name: str) -> bool:
+    with metrics.timer("wait_downloads"):
+        items = await sessions.wait_batch(user_id, batch_id)
+    if items is None:
+        # Cancelled through another worker.
+        return False
+
+    # The PDF is built in the spool directory and sent from there, split
+    # into volumes when it is larger than one upload may be.
+    fd, path = tempfile.mkstemp(dir=SPOOL_DIR, suffix=".pdf")
+    os.close(fd)
+    volumes: List[str] = []
+    try:
+        return await deliver_pdf(msg, user_id, trans, batch_id, items, file_name, path, volumes)
+    finally:
+        for volume in set(volumes + [path]):
+            try:
+                os.remove(volume)
+            except OSError:
+                pass
+
+async def deliver_pdf(msg: Message, user_id: int, trans: Dict[str, str], batch_id: str,
+                      items: List[Dict[str, Any]], file_name: str, path: str, volumes: List[str]) -> bool:
+    # Split volumes are filled to VOLUME_FILL of the cap, a single file is not.
+    max_total = max(MAX_OUTPUT_PDF_SIZE, int(MAX_OUTPUT_PDF_SIZE * VOLUME_FILL * MAX_OUTPUT_VOLUMES))
+    steps = plan_render(items, max_total, IMAGE_DPI, JPEG_QUALITY)
+    if not steps:
+        metrics.incr("conversions_total", result="too_large")
+        await msg.reply_text("⚠️ Жасалған PDF тым үлкен, материалдарды азайтыңыз.")
+        return False
 
     try:
-        merged_pdf = await merge_pdfs(pdf_list)
+        with metrics.track("conversions_in_progress"), metrics.timer("render"):
+            render = functools.partial(render_backend.render, path=path)
+            pdf_size, errors = await render_within_budget(render, items, max_total, steps)
     except Exception as e:
+        metrics.error("render", type(e).__name__)
         await msg.reply_text(f"❌ PDF біріктіру қатесі: {e}")
-        merged_pdf = None
+        pdf_size, errors = None, []
+    for i, e in errors:
+        await msg.reply_text(f"❌ {i+1}-ші элементті өңдеу қатесі: {e}")
 
-    if not merged_pdf:
+    if not pdf_size:
+        metrics.incr("conversions_total", result="failed")
         await msg.reply_text("❌ PDF генерациясында қате шықты, қайта көріңіз.")
-        return STATE_ACCUMULATE
+        return False
 
-    merged_pdf.seek(0, os.SEEK_END)
-    pdf_size = merged_pdf.tell()
-    merged_pdf.seek(0)
-    if pdf_size > MAX_OUTPUT_PDF_SIZE:
+    if pdf_size > max_total:
+        metrics.incr("conversions_total", result="too_large")
         await msg.reply_text("⚠️ Жасалған PDF тым үлкен, материалдарды азайтыңыз.")
-        return STATE_ACCUMULATE
+        return False
+
+    if pdf_size > MAX_OUTPUT_PDF_SIZE:
+        from pdf_builder import split_pdf
+
+        loop = asyncio.get_running_loop()
+        with metrics.timer("split_volumes"):
+            volumes += await loop.run_in_executor(None, split_pdf, path, MAX_OUTPUT_PDF_SIZE)
+        if len(volumes) > MAX_OUTPUT_VOLUMES:
+            # Pages that do not pack well can still need more volumes.
+            metrics.incr("conversions_total", result="too_large")
+            await msg.reply_text("⚠️ Жасалған PDF тым үлкен, материалдарды азайтыңыз.")
+            return False
+    else:
+        volumes.append(path)
+
+    if sessions.batch(user_id, batch_id) is None:
+        return False
 
     if not file_name:
         file_name = f"combined_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
 
-    await msg.reply_document(
-        document=merged_pdf,
-        filename=file_name,
-        caption=f"🎉 {trans['pdf_ready']}"
-    )
+    try:
+        with metrics.timer("upload"):
+            for number, volume in enumerate(volumes, 1):
+                if len(volumes) == 1:
+                    name, caption = file_name, f"🎉 {trans['pdf_ready']}"
+                else:
+                    name = volume_name(file_name, number)
+                    caption = f"🎉 {trans['pdf_ready']} ({number}/{len(volumes)})"
+                await uploader.send_document(msg.get_bot(), msg.chat_id, volume, name, caption)
+                metrics.incr("bytes_out_total", os.path.getsize(volume))
+    except Exception as e:
+        metrics.error("upload", type(e).__name__)
+        metrics.incr("conversions_total", result="failed")
+        raise
+    metrics.incr("conversions_total", result="ok")
+    if len(volumes) > 1:
+        metrics.incr("volumes_total", len(volumes))
     save_stats("pdf")
-    user_data[user_id]["items"] = []
-    user_data[user_id]["instruction_sent"] = False
-    await msg.reply_text(
-        trans["instruction_initial"],
-        reply_markup=ReplyKeyboardMarkup(
-            [[f"📄 {trans['btn_convert_pdf']}"],
-             [f"🌐 {trans['btn_change_lang']}", f"❓ {trans['btn_help']}"]],
-            resize_keyboard=True
-        )
-    )
-    return STATE_ACCUMULATE
+    return True
 
 async def trigger_change_lang(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -436,29 +682,35 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if str(user_id) != ADMIN_ID:
         await update.message.reply_text("Сіз админ емессіз.")
-        return
-    trans = load_translations("kz")
+        return ConversationHandler.END
     await show_admin_stats(update, context)
+    return ADMIN_MENU
 
 async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open(STATS_FILE, "r") as f:
-            stats = json.load(f)
-    except Exception:
-        stats = {"total": 0, "items": 0, "pdf_count": 0}
-    try:
-        with open(USERS_FILE, "r") as f:
-            users = json.load(f)
-    except Exception:
-        users = {}
-    total_users = len(users)
+    stats = storage.counters()
+    total_users = storage.user_count()
+    loop = asyncio.get_running_loop()
+    session_stats = await loop.run_in_executor(None, sessions.stats)
+    cache_stats = await loop.run_in_executor(None, media_cache.stats)
+    queue_stats = scheduler.stats()
     stat_text = (
         f"📊 Статистика:\n"
         f"• Жалпы әрекет саны: {stats.get('total', 0)}\n"
         f"• Жинақталған элементтер: {stats.get('items', 0)}\n"
         f"• PDF файлдар саны: {stats.get('pdf_count', 0)}\n"
         f"• Пайдаланушылар саны: {total_users}\n"
+        f"• Белсенді сессиялар: {session_stats['sessions']} ({session_stats['items']} элемент)\n"
+        f"• Жадтағы деректер: {session_stats['resident_bytes'] / 1024 / 1024:.1f} MB\n"
+        f"• Дискідегі деректер: {session_stats['spooled_bytes'] / 1024 / 1024:.1f} MB\n"
+        f"• Кезек: {queue_stats['running']} орындалуда, {queue_stats['queued']} күтуде\n"
+        f"• Кэш: {cache_stats['entries']} файл, {cache_stats['bytes'] / 1024 / 1024:.1f} MB "
+        f"(табылды {cache_stats['hits']}, табылмады {cache_stats['misses']})\n"
     )
+    stage_stats = metrics.stage_summary()
+    if stage_stats:
+        stat_text += "\n⏱ Кезеңдер (p50 / p95):\n"
+        for stage, (p50, p95, count) in stage_stats.items():
+            stat_text += f"• {stage}: {p50 * 1000:.0f} / {p95 * 1000:.0f} ms ({count})\n"
     keyboard = ReplyKeyboardMarkup(
         [["📊 Статистика", "📢 Хабарлама жіберу"],
          ["🔀 Форвард хабарлама", "❌ Жабу"]],
@@ -466,73 +718,145 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(stat_text, reply_markup=keyboard)
 
+def start_broadcast(bot, broadcast_id: int):
+    job = BroadcastJob(bot, storage, broadcast_id, BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL)
+    background_tasks.append(asyncio.create_task(job.run()))
+
 async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cmd = update.message.text.strip().lower()
+    cmd = update.message.text.strip().lower() if update.message.text else ""
     if cmd == "📊 статистика":
         await show_admin_stats(update, context)
     elif cmd == "📢 хабарлама жіберу":
         await update.message.reply_text("📢 Хабарлама жіберу үшін мәтінді енгізіңіз:")
-        context.user_data["admin_action"] = "broadcast"
+        sessions.update(update.effective_user.id, admin_action="broadcast")
+        return ADMIN_BROADCAST
     elif cmd == "🔀 форвард хабарлама":
         await update.message.reply_text("🔀 Форвардтау үшін хабарламаны енгізіңіз:")
-        context.user_data["admin_action"] = "forward"
-    elif cmd == "❌ жабу":
+        sessions.update(update.effective_user.id, admin_action="forward")
+        return ADMIN_FORWARD
+    elif cmd in ("❌ жабу", "/cancel"):
+        sessions.update(update.effective_user.id, admin_action=None)
         await update.message.reply_text("Админ панелі жабылды.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
     else:
-        if context.user_data.get("admin_action") == "broadcast":
-            user_ids = get_all_users()
-            sent = 0
-            for uid in user_ids:
-                try:
-                    await context.bot.send_message(chat_id=uid, text=f"[Админ хабарламасы]\n\n{update.message.text}")
-                    sent += 1
-                except Exception:
-                    pass
-            await update.message.reply_text(f"Хабарлама {sent} пайдаланушыға жіберілді.")
-            context.user_data.pop("admin_action", None)
-        elif context.user_data.get("admin_action") == "forward":
-            admin_msg: Message = update.message
-            user_ids = get_all_users()
-            forwarded = 0
-            for uid in user_ids:
-                try:
-                    await context.bot.copy_message(chat_id=uid, from_chat_id=admin_msg.chat.id, message_id=admin_msg.message_id)
-                    forwarded += 1
-                except Exception:
-                    pass
-            await update.message.reply_text(f"Хабарлама {forwarded} пайдаланушыға форвардталды.")
-            context.user_data.pop("admin_action", None)
+        admin_msg: Message = update.message
+        admin_action = sessions.get(update.effective_user.id).get("admin_action")
+        if admin_action == "broadcast":
+            broadcast_id = storage.create_broadcast("broadcast", admin_msg.chat.id, text=admin_msg.text)
+        elif admin_action == "forward":
+            broadcast_id = storage.create_broadcast(
+                "forward", admin_msg.chat.id, from_chat_id=admin_msg.chat.id, message_id=admin_msg.message_id
+            )
         else:
             await update.message.reply_text("Админ бұйрығын дұрыс енгізіңіз.")
-
-admin_conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("admin", admin_panel)],
-    states={
-        ADMIN_MENU: [
-            MessageHandler(filters.Regex("^(📊 Статистика|📢 Хабарлама жіберу|🔀 Форвард хабарлама|❌ Жабу)$"), admin_command_handler)
-        ],
-        ADMIN_BROADCAST: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, admin_command_handler)
-        ],
-        ADMIN_FORWARD: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, admin_command_handler)
-        ]
-    },
-    fallbacks=[CommandHandler("cancel", admin_command_handler)]
-)
+            return ADMIN_MENU
+        sessions.update(update.effective_user.id, admin_action=None)
+        start_broadcast(context.bot, broadcast_id)
+        await update.message.reply_text("📢 Жіберу фонда басталды, барысы осы чатта көрсетіледі.")
+    return ADMIN_MENU
+
+def admin_conversation() -> SharedConversationHandler:
+    return SharedConversationHandler(
+        entry_points=[CommandHandler("admin", admin_panel)],
+        states={
+            ADMIN_MENU: [
+                MessageHandler(filters.Regex("^(📊 Статистика|📢 Хабарлама жіберу|🔀 Форвард хабарлама|❌ Жабу)$"), admin_command_handler)
+            ],
+            ADMIN_BROADCAST: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_command_handler)
+            ],
+            ADMIN_FORWARD: [
+                MessageHandler(filters.ALL & ~filters.COMMAND, admin_command_handler)
+            ]
+        },
+        fallbacks=[CommandHandler("cancel", admin_command_handler)],
+        name="admin",
+        backend=session_backend
+    )
 
 # --- Fallback ---
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data.pop(user_id, None)
+    scheduler.cancel(user_id)
+    albums.discard_user(user_id)
+    sessions.drop(user_id)
     await update.message.reply_text("❌ Операция тоқтатылды. /start арқылы қайта бастаңыз.")
     return STATE_ACCUMULATE
 
-# --- Main ---
-if __name__ == "__main__":
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+# --- Lifecycle ---
+async def evict_idle_sessions():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        # Loads every session record, so it runs off the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, sessions.evict_idle)
+
+async def flush_stats():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        storage.flush()
+
+async def warm_up_renderer():
+    # Runs after startup so the webhook is served while the PDF libraries
+    # and fonts load; a conversion arriving first simply loads them itself.
+    try:
+        await render_backend.warm_up()
+    except Exception as e:
+        metrics.error("warm_up", type(e).__name__)
+
+async def post_init(application):
+    background_tasks.append(asyncio.create_task(evict_idle_sessions()))
+    background_tasks.append(asyncio.create_task(flush_stats()))
+    # Broadcasts interrupted by a restart continue with the remaining users.
+    for broadcast_id in storage.unfinished_broadcasts():
+        start_broadcast(application.bot, broadcast_id)
+    if TRANSLATIONS_WATCH:
+        background_tasks.append(asyncio.create_task(catalog.watch(TRANSLATIONS_WATCH_INTERVAL)))
+    if METRICS_PORT:
+        await metrics.serve(METRICS_HOST, METRICS_PORT)
+    if RENDER_WARMUP:
+        background_tasks.append(asyncio.create_task(warm_up_renderer()))
+
+async def post_shutdown(application):
+    for task in background_tasks:
+        task.cancel()
+    await albums.shutdown()
+    await scheduler.shutdown()
+    render_backend.shutdown()
+    await metrics.close()
+    await downloader.close()
+    await uploader.close()
+    storage.close()
+    media_cache.close()
+    session_backend.close()
+
+async def serve_webhook(application, webhook_url: str, port: int):
+    # run_webhook with the port bound first: a cold start answers health
+    # checks while initialize() (getMe) and post_init run, and holds
+    # Telegram's requests until they are done.
+    server = WebhookServer(urlparse(webhook_url).path or "/", WEBHOOK_SECRET)
+    await server.start("0.0.0.0", port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await application.initialize()
+        await post_init(application)
+        await application.bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES,
+                                          secret_token=WEBHOOK_SECRET)
+        await application.start()
+        server.attach(application)
+        await stop.wait()
+    finally:
+        await server.close()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
 
-    conv_handler = ConversationHandler(
+# --- Main ---
+def main_conversation() -> SharedConversationHandler:
+    return SharedConversationHandler(
         entry_points=[CommandHandler("start", start_handler)],
         states={
             STATE_ACCUMULATE: [
@@ -545,17 +869,107 @@ if __name__ == "__main__":
                 MessageHandler(filters.TEXT & ~filters.COMMAND, filename_input_handler)
             ]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="main",
+        backend=session_backend
     )
-    application.add_handler(conv_handler)
+
+def session_gauges() -> Dict[str, int]:
+    stats = sessions.stats()
+    return {"sessions_active": stats["sessions"], "session_items": stats["items"],
+            "pending_downloads": stats["pending"], "session_resident_bytes": stats["resident_bytes"],
+            "session_spooled_bytes": stats["spooled_bytes"]}
+
+def scheduler_gauges() -> Dict[str, int]:
+    stats = scheduler.stats()
+    return {"conversion_queue_depth": stats["queued"], "conversions_running": stats["running"],
+            "conversion_memory_bytes": stats["running_bytes"]}
+
+def media_cache_gauges() -> Dict[str, int]:
+    stats = media_cache.stats()
+    return {"media_cache_bytes": stats["bytes"], "media_cache_hits": stats["hits"],
+            "media_cache_misses": stats["misses"]}
+
+def update_gauges(application: UserOrderedApplication) -> Dict[str, int]:
+    stats = application.stats()
+    return {"update_users_active": stats["users"], "updates_queued": stats["queued"]}
+
+def setup():
+    global storage, catalog, downloader, albums, uploader, session_backend, sessions, media_cache
+    global metrics, scheduler, render_backend, admin_conv_handler, conv_handler
+    storage = Storage(DB_FILE, LANG_CACHE_TTL)
+    storage.migrate_json(USERS_FILE, STATS_FILE)
+    catalog = TranslationCatalog(TRANSLATIONS_DIR, LANGUAGES, DEFAULT_LANG)
+    downloader = Downloader(DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT)
+    albums = AlbumBuffer(ALBUM_WINDOW, lambda user_id, parts: commit_album(user_id, parts))
+    uploader = Uploader(UPLOAD_TIMEOUT)
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    session_backend = create_session_backend(SESSION_BACKEND, SESSION_DB)
+    sessions = SessionStore(SPOOL_DIR, MAX_SESSION_BYTES, MAX_SESSION_ITEMS, SESSION_IDLE_TTL, session_backend,
+                            batch_ttl=SESSION_BATCH_TTL)
+    media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE)
+    metrics = Metrics()
+    scheduler = ConversionScheduler(MAX_CONCURRENT_CONVERSIONS, CONVERSION_MEMORY_BUDGET, MAX_QUEUED_CONVERSIONS)
+    render_backend = create_render_backend(RENDER_BACKEND, RENDER_WORKERS, metrics, PDF_CHUNK_PAGES, MAX_PAGES_IN_FLIGHT)
+    # One stats() call per source and scrape; session and cache stats read
+    # the backends, so they are collected off the event loop.
+    metrics.collector({
+        "sessions_active": "Sessions held in memory.",
+        "session_items": "Items waiting in sessions.",
+        "pending_downloads": "Items still downloading or pre-rendering.",
+        "session_resident_bytes": "Session payload bytes in memory.",
+        "session_spooled_bytes": "Session payload bytes on disk.",
+    }, session_gauges, blocking=True)
+    metrics.gauge("album_parts_buffered", "Album messages waiting to be committed.", lambda: albums.pending())
+    metrics.collector({
+        "conversion_queue_depth": "Conversions waiting for a slot.",
+        "conversions_running": "Conversions holding a slot.",
+        "conversion_memory_bytes": "Estimated memory of running conversions.",
+    }, scheduler_gauges)
+    metrics.collector({
+        "media_cache_bytes": "Bytes held by the media cache.",
+        "media_cache_hits": "Media cache hits since start.",
+        "media_cache_misses": "Media cache misses since start.",
+    }, media_cache_gauges, blocking=True)
+    admin_conv_handler = admin_conversation()
+    conv_handler = main_conversation()
+
+def add_handlers(application):
+    # Runs for every update before the handlers below (group -1).
+    application.add_handler(TypeHandler(Update, mark_active), group=-1)
+    # The admin conversation goes first so that it sees the admin's
+    # messages before the accumulating conversation does.
     application.add_handler(admin_conv_handler)
+    application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(change_language, pattern="^lang_"))
 
-    if os.environ.get("WEBHOOK_URL"):
+if __name__ == "__main__":
+    setup()
+    # Different users are served concurrently, each user's updates one at a
+    # time and in order (see UserOrderedApplication).
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .application_class(UserOrderedApplication)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    add_handlers(application)
+    metrics.collector({
+        "update_users_active": "Users whose updates are being processed.",
+        "updates_queued": "Updates waiting behind the same user's earlier ones.",
+    }, lambda: update_gauges(application))
+
+    if os.environ.get("WEBHOOK_URL") and WEBHOOK_EARLY_BIND:
+        asyncio.run(serve_webhook(application, os.environ["WEBHOOK_URL"], int(os.environ.get("PORT", 10000))))
+    elif os.environ.get("WEBHOOK_URL"):
         application.run_webhook(
             listen="0.0.0.0",
             port=int(os.environ.get("PORT", 10000)),
-            webhook_url=os.environ.get("WEBHOOK_URL")
+            webhook_url=os.environ.get("WEBHOOK_URL"),
+            secret_token=WEBHOOK_SECRET
         )
     else:
         application.run_polling()
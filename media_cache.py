@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+def temp_path(dst: str) -> Tuple[int, str]:
+    # A unique file next to dst, so concurrent writers of one entry never
+    # share it and os.replace stays on the same file system.
+    return tempfile.mkstemp(dir=os.path.dirname(dst) or ".", prefix=".", suffix=".tmp")
+
+def link_or_copy(src: str, dst: str):
+    # Spool files and cache entries are never written after creation, so a
+    # hard link is as good as a copy and much cheaper.
+    fd, tmp = temp_path(dst)
+    os.close(fd)
+    try:
+        os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        # Leaves tmp in place when dst already is a link to the same file.
+        os.replace(tmp, dst)
+    finally:
+        remove_quietly(tmp)
+
+def remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class MediaCache:
+    # Downloaded files and rendered results on local disk, keyed by Telegram's
+    # file_unique_id and the render parameters. The index is a SQLite table
+    # in the cache directory so entries and their LRU order survive restarts;
+    # the least recently used entries go once max_bytes is exceeded.
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, "index.db"),
+                                    check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def key(file_unique_id: str, *params) -> str:
+        return hashlib.sha256(":".join([file_unique_id, *map(str, params)]).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    # --- Lookup ---
+    def lookup(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self.lock:
+            row = self.conn.execute("SELECT meta FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        path = self._path(key)
+        if row is None or not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path, json.loads(row[0])
+
+    def fetch(self, key: str, dst: str) -> Optional[Dict[str, Any]]:
+        # Puts a cached file at dst and returns its metadata, or None on a miss.
+        found = self.lookup(key)
+        if found is None:
+            return None
+        path, meta = found
+        try:
+            link_or_copy(path, dst)
+        except OSError:
+            # Evicted in the meantime.
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return meta
+
+    def read(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        found = self.lookup(key)
+        if found is None:
+            return None
+        path, meta = found
+        try:
+            with open(path, "rb") as f:
+                return f.read(), meta
+        except OSError:
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    # --- Insertion ---
+    def _insert(self, key: str, size: int, meta: Dict[str, Any]):
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, meta, last_used) VALUES (?, ?, ?, ?)",
+                (key, size, json.dumps(meta), time.time())
+            )
+            self.total += size - (row[0] if row else 0)
+        self._evict(keep=key)
+
+    def store(self, key: str, src: str, meta: Dict[str, Any]):
+        if os.path.getsize(src) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(src, path)
+        self._insert(key, os.path.getsize(path), meta)
+
+    def store_bytes(self, key: str, data: bytes, meta: Dict[str, Any]):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = temp_path(path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        finally:
+            remove_quietly(tmp)
+        self._insert(key, len(data), meta)
+
+    def _evict(self, keep: str):
+        while self.total > self.max_bytes:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT key, size FROM entries WHERE key != ? ORDER BY last_used LIMIT 1", (keep,)
+                ).fetchone()
+                if row is None:
+                    return
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+                self.total -= row[1]
+            remove_quietly(self._path(row[0]))
+
+    # --- Stats ---
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": entries, "bytes": self.total, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
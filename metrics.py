@@ -0,0 +1,197 @@
+import asyncio
+import bisect
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STAGE_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+RECENT_WINDOW = 1000
+
+DESCRIPTIONS = {
+    "stage_seconds": "Time spent per pipeline stage.",
+    "items_total": "Items accepted into sessions by type.",
+    "bytes_in_total": "Bytes received from users.",
+    "bytes_out_total": "Bytes of PDF sent to users.",
+    "conversions_total": "Finished conversions by result.",
+    "volumes_total": "Volumes sent for PDFs split above the size cap.",
+    "errors_total": "Errors by stage and exception type.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Gauge = Tuple[str, str, float]  # (name, description, value)
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+def format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+# --- Histograms ---
+class Histogram:
+    # Cumulative buckets for the exporter plus a window of recent samples
+    # for percentiles in the admin view.
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_WINDOW)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+# --- Registry ---
+class Metrics:
+    def __init__(self, prefix: str = "pdfgenius"):
+        self.prefix = prefix
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        # (descriptions by gauge name, callback returning values by name, blocking)
+        self.collectors: List[Tuple[Dict[str, str], Callable[[], Dict[str, Any]], bool]] = []
+        self.inflight: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(STAGE_BUCKETS)
+            histogram.observe(seconds)
+
+    def incr(self, name: str, amount: float = 1, **labels):
+        with self.lock:
+            self.counters[name][tuple(sorted(labels.items()))] += amount
+
+    def error(self, stage: str, error_type: str):
+        self.incr("errors_total", stage=stage, type=error_type)
+
+    def record(self, events: List[Tuple[str, float, Optional[str]]]):
+        # Stage timings reported by a render, possibly from another process.
+        for stage, seconds, error_type in events:
+            self.observe(stage, seconds)
+            if error_type:
+                self.error(stage, error_type)
+
+    def gauge(self, name: str, description: str, func: Callable[[], float]):
+        self.collector({name: description}, lambda: {name: func()})
+
+    def collector(self, descriptions: Dict[str, str], func: Callable[[], Dict[str, Any]], blocking: bool = False):
+        # Several gauges from one callback, called once per scrape; only the
+        # names in descriptions are exported. Blocking callbacks (database
+        # reads, work per session) run in a thread instead of the event loop.
+        self.collectors.append((descriptions, func, blocking))
+
+    def _collect(self, blocking: bool) -> List[Gauge]:
+        gauges = []
+        for descriptions, func, is_blocking in self.collectors:
+            if is_blocking != blocking:
+                continue
+            try:
+                values = func()
+            except Exception:
+                continue
+            gauges += [(name, description, values[name])
+                       for name, description in descriptions.items() if name in values]
+        return gauges
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def track(self, name: str):
+        with self.lock:
+            self.inflight[name] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.inflight[name] -= 1
+
+    def stage_summary(self) -> Dict[str, Tuple[float, float, int]]:
+        with self.lock:
+            return {stage: (h.percentile(0.5), h.percentile(0.95), h.count)
+                    for stage, h in sorted(self.stages.items())}
+
+    # --- Exposition ---
+    async def scrape(self) -> str:
+        blocking = await asyncio.get_running_loop().run_in_executor(None, self._collect, True)
+        return self.render(self._collect(False) + blocking)
+
+    def render(self, gauges: List[Gauge] = None) -> str:
+        if gauges is None:
+            gauges = self._collect(False) + self._collect(True)
+        p = self.prefix
+        lines = []
+        with self.lock:
+            name = f"{p}_stage_seconds"
+            lines += [f"# HELP {name} {DESCRIPTIONS['stage_seconds']}", f"# TYPE {name} histogram"]
+            for stage, h in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+            for counter, series in sorted(self.counters.items()):
+                name = f"{p}_{counter}"
+                lines += [f"# HELP {name} {DESCRIPTIONS.get(counter, counter)}", f"# TYPE {name} counter"]
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            for gauge, value in sorted(self.inflight.items()):
+                lines += [f"# TYPE {p}_{gauge} gauge", f"{p}_{gauge} {value}"]
+        for gauge, description, value in sorted(gauges):
+            lines += [f"# HELP {p}_{gauge} {description}", f"# TYPE {p}_{gauge} gauge", f"{p}_{gauge} {format_value(value)}"]
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", (await self.scrape()).encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,21 @@
+from typing import Dict, Any, Tuple
+
+from reportlab.lib.pagesizes import A4
+
+# Page geometry shared by the size planner and the PDF builder. Kept apart
+# from pdf_builder so estimating does not load the rendering libraries.
+
+IMAGE_MARGIN = 40
+
+def fit_to_page(img_width: int, img_height: int) -> Tuple[int, int]:
+    available_width = A4[0] - 2 * IMAGE_MARGIN
+    available_height = A4[1] - 2 * IMAGE_MARGIN
+    scale = min(1.0, available_width / img_width, available_height / img_height)
+    return int(img_width * scale), int(img_height * scale)
+
+def page_range(item: Dict[str, Any]) -> Tuple[int, int]:
+    from_page = item.get("from_page", 0)
+    to_page = item.get("to_page", -1)
+    if to_page < 0:
+        to_page = item["page_count"] - 1
+    return from_page, to_page
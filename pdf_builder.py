@@ -0,0 +1,413 @@
+import asyncio
+import os
+import threading
+import time
+from io import BytesIO
+from typing import BinaryIO, Dict, Any, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.utils import ImageReader
+
+from page_layout import fit_to_page, page_range
+from size_planner import VOLUME_FILL
+from text_layout import TextFlow
+
+FONT_NAME = "EmojiFont"
+FONT_SIZE = 12
+IMAGE_DPI = 150
+JPEG_QUALITY = 90
+
+# Images are embedded as binary streams; ASCII85 would add a quarter on top.
+rl_config.useA85 = 0
+
+# --- Register fonts ---
+# Parsed on first use rather than at import, see warm_up().
+fonts_lock = threading.Lock()
+fonts_registered = False
+
+def register_fonts():
+    global fonts_registered
+    if fonts_registered:
+        return
+    with fonts_lock:
+        if fonts_registered:
+            return
+        try:
+            pdfmetrics.registerFont(TTFont(FONT_NAME, 'fonts/Symbola.ttf'))
+        except Exception:
+            pdfmetrics.registerFont(TTFont(FONT_NAME, 'fonts/NotoSans.ttf'))
+        fonts_registered = True
+
+def warm_up():
+    # Loads what the first render would otherwise pay for.
+    register_fonts()
+    pdfmetrics.getFont(FONT_NAME).stringWidth("Aa", FONT_SIZE)
+
+# --- Item content ---
+# Binary content is either a BytesIO or a session store payload, which may
+# live in memory or in a spool file.
+def open_content(content) -> BinaryIO:
+    if isinstance(content, BytesIO):
+        return BytesIO(content.getvalue())
+    return content.open()
+
+def open_pdf(content) -> fitz.Document:
+    path = getattr(content, "path", None)
+    if path:
+        return fitz.open(path, filetype="pdf")
+    return fitz.open(stream=content.getvalue(), filetype="pdf")
+
+# --- Photo preparation ---
+class JpegImage(ImageReader):
+    # An encoded JPEG that ReportLab embeds as-is (DCTDecode). drawImage only
+    # uses getRGBData() to name and deduplicate images, so the encoded bytes
+    # stand in for the pixels and the image is never decoded again.
+    def __init__(self, data: bytes, size: Tuple[int, int]):
+        self.fileName = f"JPEG_{id(self)}"
+        self._ident = None
+        self._image = None
+        self._width, self._height = size
+        self._transparent = None
+        self._data = data
+        self._dataA = None
+        self.fp = BytesIO(data)
+
+    def jpeg_fh(self):
+        self.fp.seek(0)
+        return self.fp
+
+    def getRGBData(self):
+        return self._data
+
+    def getTransparent(self):
+        return None
+
+def prepare_photo(content, dpi: int, quality: int,
+                  copy_source: bool = True) -> Tuple[Optional[bytes], Tuple[int, int], Tuple[int, int]]:
+    # Returns JPEG data, its pixel size and the size it is drawn at in points.
+    # The drawn size is the same as before; dpi only decides how many pixels
+    # back it. A JPEG that already fits is embedded unchanged, anything else
+    # is encoded exactly once. Without copy_source the data of an unchanged
+    # JPEG is None, meaning the source itself.
+    with open_content(content) as fp:
+        img = Image.open(fp)
+        display = fit_to_page(*img.size)
+        target = (max(1, round(display[0] * dpi / 72)), max(1, round(display[1] * dpi / 72)))
+        if img.format == "JPEG" and img.mode in ("RGB", "L") and img.width <= target[0] and img.height <= target[1]:
+            if not copy_source:
+                return None, img.size, display
+            fp.seek(0)
+            return fp.read(), img.size, display
+        if img.format == "JPEG":
+            # Let libjpeg decode straight at 1/2, 1/4 or 1/8 scale.
+            img.draft(img.mode, target)
+        img.load()
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.width > target[0] or img.height > target[1]:
+        img = img.resize(target, Image.LANCZOS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    compressed = BytesIO()
+    img.save(compressed, format="JPEG", quality=quality, optimize=True)
+    return compressed.getvalue(), img.size, display
+
+# --- Item drawing ---
+def draw_text_item(c: canvas.Canvas, content: str):
+    flow = TextFlow(c, FONT_NAME, FONT_SIZE)
+    flow.add(content)
+    flow.close()
+
+def rendered_photo(item: Dict[str, Any], dpi: int, quality: int):
+    # A photo prepared in the background at these settings, if any.
+    rendered = item.get("rendered", {}).get((dpi, quality))
+    if rendered is None:
+        return None
+    payload, size, display = rendered
+    data = payload.getvalue() if payload is not None else item["content"].getvalue()
+    return data, size, display
+
+def draw_photo_item(c: canvas.Canvas, content, dpi: int = IMAGE_DPI, quality: int = JPEG_QUALITY,
+                    prepared=None):
+    width, height = A4
+    c.setFont(FONT_NAME, FONT_SIZE)
+    try:
+        data, size, (new_width, new_height) = prepared or prepare_photo(content, dpi, quality)
+        x = (A4[0] - new_width) / 2
+        y = (A4[1] - new_height) / 2
+        c.drawImage(JpegImage(data, size), x, y, width=new_width, height=new_height)
+    except Exception as e:
+        c.drawString(40, height/2, f"😢 Error: {e}")
+    c.showPage()
+
+def draw_item(c: canvas.Canvas, item: Dict[str, Any], dpi: int = IMAGE_DPI, quality: int = JPEG_QUALITY):
+    if item["type"] == "text":
+        draw_text_item(c, item["content"])
+    elif item["type"] == "photo":
+        draw_photo_item(c, item["content"], dpi, quality, rendered_photo(item, dpi, quality))
+
+# --- Source PDF helpers ---
+def inspect_pdf(content) -> int:
+    try:
+        doc = open_pdf(content)
+    except Exception:
+        return 0
+    with doc:
+        if doc.needs_pass:
+            return 0
+        return doc.page_count
+
+def image_info(content) -> Tuple[int, int, str]:
+    # Reads the header only, the pixels are decoded at build time.
+    with open_content(content) as fp:
+        img = Image.open(fp)
+        return img.width, img.height, img.format
+
+def rasterize_pages(content, from_page: int, to_page: int, dpi: int,
+                    quality: int) -> Iterator[Tuple[bytes, Tuple[int, int], Tuple[int, int]]]:
+    # Pages as prepared photos (see prepare_photo), one at a time so only
+    # the page being drawn is held in memory. Each page is rendered straight
+    # at the pixel size it is drawn at, so the JPEG is encoded only once.
+    with open_pdf(content) as doc:
+        for page_num in range(from_page, to_page + 1):
+            page = doc.load_page(page_num)
+            display = fit_to_page(page.rect.width, page.rect.height)
+            zoom = display[0] * dpi / 72 / page.rect.width
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            yield pix.tobytes("jpg", jpg_quality=quality), (pix.width, pix.height), display
+
+# --- Single-pass document builder ---
+ITEM_STAGES = {"text": "layout_text", "photo": "draw_photo", "pdf": "insert_pdf"}
+
+class PdfBuilder:
+    # Text and photo items are drawn onto one ReportLab canvas. Sessions that
+    # contain uploaded PDFs are assembled in a PyMuPDF document instead, with
+    # the canvas pages between two PDFs inserted as one segment.
+    # output is any writable binary file, e.g. a spool file.
+    def __init__(self, output: BinaryIO = None, passthrough: bool = False,
+                 dpi: int = IMAGE_DPI, quality: int = JPEG_QUALITY):
+        register_fonts()
+        self.output = output if output is not None else BytesIO()
+        self.dpi = dpi
+        self.quality = quality
+        self.document = fitz.open() if passthrough else None
+        self.segment = None
+        self.canvas = None
+        self.flow = None
+        self.errors: List[Tuple[int, Exception]] = []
+        # Whether any item made it into the document.
+        self.drawn = False
+        # (stage, seconds, error type) for every item and the final save.
+        self.events: List[Tuple[str, float, Optional[str]]] = []
+        self.stage = None
+
+    def _get_canvas(self) -> canvas.Canvas:
+        if self.canvas is None:
+            self.segment = self.output if self.document is None else BytesIO()
+            self.canvas = canvas.Canvas(self.segment, pagesize=A4)
+        return self.canvas
+
+    def _get_flow(self) -> TextFlow:
+        if self.flow is None:
+            self.flow = TextFlow(self._get_canvas(), FONT_NAME, FONT_SIZE)
+        return self.flow
+
+    def _close_flow(self):
+        # Anything that is not text starts on a page of its own.
+        if self.flow is not None:
+            self.flow.close()
+            self.flow = None
+
+    def _flush_segment(self):
+        self._close_flow()
+        if self.canvas is None:
+            return
+        self.canvas.save()
+        with fitz.open(stream=self.segment.getvalue(), filetype="pdf") as seg:
+            self.document.insert_pdf(seg)
+        self.canvas = None
+        self.segment = None
+
+    def _insert_pdf(self, item: Dict[str, Any]):
+        from_page, to_page = page_range(item)
+        with open_pdf(item["content"]) as src:
+            if src.is_encrypted:
+                raise ValueError("encrypted PDF")
+            self._flush_segment()
+            self.document.insert_pdf(src, from_page=from_page, to_page=to_page)
+
+    def _rasterize_pdf(self, item: Dict[str, Any]):
+        from_page, to_page = page_range(item)
+        pages = rasterize_pages(item["content"], from_page, to_page, self.dpi, self.quality)
+        # The first page is rendered before the canvas is touched, so an
+        # unreadable PDF leaves no empty segment behind.
+        first = next(pages, None)
+        if first is None:
+            raise ValueError("PDF could not be read")
+        self._close_flow()
+        c = self._get_canvas()
+        draw_photo_item(c, None, self.dpi, self.quality, first)
+        for prepared in pages:
+            draw_photo_item(c, None, self.dpi, self.quality, prepared)
+
+    def _add_pdf(self, item: Dict[str, Any]):
+        if self.document is not None:
+            try:
+                self._insert_pdf(item)
+                return
+            except Exception:
+                # Broken or encrypted sources cannot be copied natively.
+                pass
+        self.stage = "rasterize_pdf"
+        self._rasterize_pdf(item)
+
+    def add_item(self, index: int, item: Dict[str, Any]):
+        self.stage = ITEM_STAGES.get(item["type"], "draw_photo")
+        start = time.perf_counter()
+        error_type = None
+        try:
+            if "error" in item:
+                # The file never made it to the spool, e.g. a failed download.
+                raise ValueError(item["error"])
+            if item["type"] == "text":
+                self._get_flow().add(item["content"])
+            elif item["type"] == "pdf":
+                self._add_pdf(item)
+            else:
+                self._close_flow()
+                draw_item(self._get_canvas(), item, self.dpi, self.quality)
+            self.drawn = True
+        except Exception as e:
+            # Close whatever the failed item managed to draw so the next
+            # item still starts on a fresh page.
+            self.errors.append((index, e))
+            error_type = type(e).__name__
+            self._close_flow()
+            if self.canvas is not None and self.canvas._code:
+                self.canvas.showPage()
+        self.events.append((self.stage, time.perf_counter() - start, error_type))
+
+    def finish(self) -> Optional[BytesIO]:
+        start = time.perf_counter()
+        output = self._finish()
+        self.events.append(("save_pdf", time.perf_counter() - start, None))
+        return output
+
+    def _finish(self) -> Optional[BytesIO]:
+        self._close_flow()
+        if not self.drawn:
+            # Every item failed, there is nothing to save.
+            if self.document is not None:
+                self.document.close()
+            return None
+        if self.document is None:
+            self._get_canvas().save()
+        else:
+            self._flush_segment()
+            # garbage=4 also merges identical objects, e.g. the same image
+            # reached through two uploaded PDFs.
+            self.document.save(self.output, garbage=4, deflate=True)
+            self.document.close()
+        self.output.seek(0)
+        return self.output
+
+def build_pdf(items: List[Dict[str, Any]], dpi: int = IMAGE_DPI, quality: int = JPEG_QUALITY,
+              events: List[Tuple[str, float, Optional[str]]] = None,
+              output: BinaryIO = None) -> Tuple[Optional[BinaryIO], List[Tuple[int, Exception]]]:
+    builder = PdfBuilder(output, passthrough=any(item["type"] == "pdf" for item in items), dpi=dpi, quality=quality)
+    for i, item in enumerate(items):
+        builder.add_item(i, item)
+    output = builder.finish()
+    if events is not None:
+        events.extend(builder.events)
+    return output, builder.errors
+
+# --- Output volumes ---
+def page_weight(doc: fitz.Document, page: fitz.Page) -> int:
+    # Stream bytes of the page's content and images. Fonts are shared by
+    # every page of a volume and left out.
+    xrefs = set(page.get_contents()) | {img[0] for img in page.get_images(full=True)}
+    weight = 1000
+    for xref in xrefs:
+        kind, value = doc.xref_get_key(xref, "Length")
+        weight += int(value) if kind == "int" else len(doc.xref_stream_raw(xref) or b"")
+    return weight
+
+def split_pdf(path: str, max_bytes: int) -> List[str]:
+    # Splits the document at page boundaries into files next to it of at
+    # most max_bytes each, in page order. A single page larger than that
+    # makes a volume of its own.
+    if os.path.getsize(path) <= max_bytes:
+        return [path]
+    volumes = []
+    with fitz.open(path) as doc:
+        ranges = []
+        first, filled = 0, 0
+        for n, page in enumerate(doc):
+            weight = page_weight(doc, page)
+            if n > first and filled + weight > max_bytes * VOLUME_FILL:
+                ranges.append((first, n - 1))
+                first, filled = n, 0
+            filled += weight
+        ranges.append((first, doc.page_count - 1))
+        while ranges:
+            first, last = ranges.pop(0)
+            volume = f"{path}.{first}-{last}"
+            with fitz.open() as out:
+                out.insert_pdf(doc, from_page=first, to_page=last)
+                out.save(volume, garbage=4, deflate=True)
+            if os.path.getsize(volume) > max_bytes and last > first:
+                os.remove(volume)
+                middle = (first + last) // 2
+                ranges[:0] = [(first, middle), (middle + 1, last)]
+                continue
+            volumes.append(volume)
+    return volumes
+
+# --- Per-item path (one document per item, merged afterwards) ---
+def convert_pdf_item_to_images(bio, from_page: int = 0, to_page: int = -1) -> List[BytesIO]:
+    images = []
+    try:
+        doc = open_pdf(bio)
+        if to_page < 0:
+            to_page = doc.page_count - 1
+        for page_num in range(from_page, to_page + 1):
+            page = doc.load_page(page_num)
+            pix = page.get_pixmap()
+            img_data = BytesIO(pix.tobytes("png"))
+            images.append(img_data)
+    except Exception as e:
+        return images
+    return images
+
+def generate_item_pdf(item: Dict[str, Any]) -> BytesIO:
+    register_fonts()
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    draw_item(c, item)
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+async def merge_pdfs(pdf_list: List[BytesIO]) -> BytesIO:
+    from PyPDF2 import PdfMerger
+
+    loop = asyncio.get_running_loop()
+    merger = PdfMerger()
+    for pdf_io in pdf_list:
+        try:
+            merger.append(pdf_io)
+        except Exception:
+            pass
+    output_buffer = BytesIO()
+    await loop.run_in_executor(None, merger.write, output_buffer)
+    merger.close()
+    output_buffer.seek(0)
+    return output_buffer
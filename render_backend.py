@@ -0,0 +1,248 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Any, List, Optional, Tuple
+
+from page_layout import page_range
+
+# PyMuPDF, ReportLab and PIL are imported on first use (or by warm_up) so
+# that importing the bot stays cheap.
+
+# Renders write the document to a file and return its size, or None when
+# nothing could be rendered, with the errors per item index.
+RenderResult = Tuple[Optional[int], List[Tuple[int, str]]]
+
+PDF_CHUNK_PAGES = 20
+MAX_PAGES_IN_FLIGHT = 100
+TEXT_CHARS_PER_PAGE = 3000  # rough, only to weigh text when balancing chunks
+
+# --- Item payloads ---
+# Items cross the process boundary as plain dicts with bytes instead of
+# BytesIO so they pickle cheaply and without shared file positions.
+def serialize_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {key: value for key, value in item.items() if key != "pending"}
+    if isinstance(payload["content"], BytesIO):
+        payload["content"] = payload["content"].getvalue()
+    return payload
+
+def deserialize_item(payload: Dict[str, Any]) -> Dict[str, Any]:
+    item = dict(payload)
+    if isinstance(item["content"], bytes):
+        item["content"] = BytesIO(item["content"])
+    return item
+
+def render_chunk(indices: List[int], payloads: List[Dict[str, Any]], dpi: int, quality: int,
+                 path: str) -> Tuple[Optional[int], List[Tuple[int, str]], List[Tuple[str, float, Optional[str]]]]:
+    from pdf_builder import PdfBuilder
+
+    items = [deserialize_item(p) for p in payloads]
+    with open(path, "wb") as f:
+        builder = PdfBuilder(f, passthrough=any(item["type"] == "pdf" for item in items), dpi=dpi, quality=quality)
+        for index, item in zip(indices, items):
+            builder.add_item(index, item)
+        output = builder.finish()
+    size = os.path.getsize(path) if output is not None else None
+    return size, [(i, str(e)) for i, e in builder.errors], builder.events
+
+def shares_page(item: Dict[str, Any]) -> bool:
+    return item["type"] == "text" and "error" not in item
+
+def text_pages(items: List[Dict[str, Any]]) -> int:
+    return max(1, math.ceil(sum(len(item["content"]) for item in items) / TEXT_CHARS_PER_PAGE))
+
+def join_segments(segments: List[str], path: str):
+    import fitz  # PyMuPDF
+
+    with fitz.open() as doc:
+        for segment in segments:
+            with fitz.open(segment, filetype="pdf") as seg:
+                doc.insert_pdf(seg)
+        doc.save(path, garbage=4, deflate=True)
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def warm_up_renderer() -> float:
+    start = time.perf_counter()
+    import pdf_builder
+    pdf_builder.warm_up()
+    return time.perf_counter() - start
+
+# --- Backends ---
+class ThreadRenderBackend:
+    # Renders the whole session in a single pass on the default executor.
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+
+    async def render(self, items: List[Dict[str, Any]], dpi: int, quality: int, path: str) -> RenderResult:
+        loop = asyncio.get_running_loop()
+        size, errors, events = await loop.run_in_executor(
+            None, render_chunk, list(range(len(items))), items, dpi, quality, path
+        )
+        if self.metrics is not None:
+            self.metrics.record(events)
+        return size, errors
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def warm_up(self):
+        seconds = await self.run(warm_up_renderer)
+        if self.metrics is not None:
+            self.metrics.observe("warm_up", seconds)
+
+    def shutdown(self):
+        pass
+
+class ProcessRenderBackend:
+    # Splits the session into contiguous chunks of about the same number of
+    # pages, renders each chunk in a worker process and joins the chunk
+    # documents in their original order. Uploaded PDFs are split into page
+    # ranges of at most chunk_pages, so a long PDF that has to be rasterized
+    # is spread over the workers too. Chunks wait while max_pages_in_flight
+    # pages are being rendered.
+    def __init__(self, workers: int, metrics=None, chunk_pages: int = PDF_CHUNK_PAGES,
+                 max_pages_in_flight: int = MAX_PAGES_IN_FLIGHT):
+        self.workers = max(1, workers)
+        self.metrics = metrics
+        self.chunk_pages = max(1, chunk_pages)
+        self.max_pages_in_flight = max_pages_in_flight
+        self.pages_in_flight = 0
+        self.capacity = asyncio.Condition()
+        self.executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _units(self, items: List[Dict[str, Any]]) -> List[Tuple[List[int], List[Dict[str, Any]], int]]:
+        # (item indices, items or parts of them, pages). Consecutive texts
+        # share pages while every chunk starts on a new one, so a run of
+        # them stays in one unit and the output matches the thread backend.
+        units = []
+        for index, item in enumerate(items):
+            if shares_page(item):
+                if units and shares_page(units[-1][1][-1]):
+                    units[-1][0].append(index)
+                    units[-1][1].append(item)
+                else:
+                    units.append(([index], [item], 0))
+                continue
+            if item["type"] != "pdf" or not item.get("page_count") or "error" in item:
+                units.append(([index], [item], 1))
+                continue
+            from_page, to_page = page_range(item)
+            for first in range(from_page, to_page + 1, self.chunk_pages):
+                last = min(to_page, first + self.chunk_pages - 1)
+                units.append(([index], [dict(item, from_page=first, to_page=last)], last - first + 1))
+        return [(indices, parts, pages or text_pages(parts)) for indices, parts, pages in units]
+
+    def _chunks(self, items: List[Dict[str, Any]]) -> List[Tuple[List[int], List[Dict[str, Any]], int]]:
+        units = self._units(items)
+        total = sum(pages for _, _, pages in units)
+        target = max(1, min(self.chunk_pages, math.ceil(total / (self.workers * 2))))
+        chunks = []
+        indices, payloads, pages = [], [], 0
+        for unit_indices, parts, unit_pages in units:
+            indices += unit_indices
+            payloads += [serialize_item(part) for part in parts]
+            pages += unit_pages
+            if pages >= target:
+                chunks.append((indices, payloads, pages))
+                indices, payloads, pages = [], [], 0
+        if payloads:
+            chunks.append((indices, payloads, pages))
+        return chunks
+
+    async def _render_chunk(self, indices: List[int], payloads: List[Dict[str, Any]], pages: int,
+                            dpi: int, quality: int, path: str):
+        async with self.capacity:
+            # A chunk larger than the cap still runs, but alone.
+            await self.capacity.wait_for(
+                lambda: not self.pages_in_flight or self.pages_in_flight + pages <= self.max_pages_in_flight
+            )
+            self.pages_in_flight += pages
+        try:
+            return await self.run(render_chunk, indices, payloads, dpi, quality, path)
+        finally:
+            async with self.capacity:
+                self.pages_in_flight -= pages
+                self.capacity.notify_all()
+
+    async def render(self, items: List[Dict[str, Any]], dpi: int, quality: int, path: str) -> RenderResult:
+        # Chunks are written next to path and joined into it.
+        chunks = self._chunks(items)
+        paths = [f"{path}.{n}" for n in range(len(chunks))]
+        try:
+            return await self._render(chunks, paths, dpi, quality, path)
+        finally:
+            remove_files(paths)
+
+    async def _render(self, chunks, paths: List[str], dpi: int, quality: int, path: str) -> RenderResult:
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            self._render_chunk(indices, payloads, pages, dpi, quality, chunk_path)
+            for (indices, payloads, pages), chunk_path in zip(chunks, paths)
+        ])
+        # A PDF split over several chunks reports its error once.
+        first_errors: Dict[int, str] = {}
+        for _, chunk_errors, _ in results:
+            for i, e in chunk_errors:
+                first_errors.setdefault(i, e)
+        errors = list(first_errors.items())
+        if self.metrics is not None:
+            for _, _, events in results:
+                self.metrics.record(events)
+        segments = [chunk_path for (size, _, _), chunk_path in zip(results, paths) if size]
+        if not segments:
+            return None, errors
+        if len(segments) == 1:
+            os.replace(segments[0], path)
+            return os.path.getsize(path), errors
+        start = time.perf_counter()
+        await loop.run_in_executor(None, join_segments, segments, path)
+        if self.metrics is not None:
+            self.metrics.observe("join_segments", time.perf_counter() - start)
+        return os.path.getsize(path), errors
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for its memory. The pool cannot be
+            # used again, so the calls it held fail and later ones get a
+            # new pool.
+            if self.executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._create_executor()
+            raise
+
+    async def warm_up(self):
+        # One call per worker; the pool starts its processes as calls queue up.
+        results = await asyncio.gather(*[self.run(warm_up_renderer) for _ in range(self.workers)])
+        if self.metrics is not None:
+            for seconds in results:
+                self.metrics.observe("warm_up", seconds)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def create_render_backend(name: str, workers: int, metrics=None, chunk_pages: int = PDF_CHUNK_PAGES,
+                          max_pages_in_flight: int = MAX_PAGES_IN_FLIGHT):
+    if name == "process":
+        return ProcessRenderBackend(workers, metrics, chunk_pages, max_pages_in_flight)
+    return ThreadRenderBackend(metrics)
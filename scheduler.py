@@ -0,0 +1,155 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+class Job:
+    def __init__(self, user_id: int, weight: int, admitted: asyncio.Future):
+        self.user_id = user_id
+        self.weight = weight
+        self.admitted = admitted
+        self.running = False
+
+class ConversionScheduler:
+    # Admits conversions round-robin across users: the waiting user that has
+    # been served least since the scheduler was last idle goes next. At most
+    # max_running jobs run at once and their estimated memory has to fit
+    # memory_budget; a single job larger than the budget still runs, but
+    # alone. Jobs are started with spawn() and wait for their turn in slot().
+    def __init__(self, max_running: int, memory_budget: int, max_queued: int):
+        self.max_running = max(1, max_running)
+        self.memory_budget = memory_budget
+        self.max_queued = max_queued
+        self.queues: Dict[int, Deque[Job]] = {}
+        self.rotation: Deque[int] = deque()
+        self.running: Set[Job] = set()
+        self.served: Dict[int, int] = {}
+        self.running_bytes = 0
+        self.tasks: Dict[int, Set[asyncio.Task]] = {}
+        # Set once shutdown() cancels the jobs, as opposed to a user's cancel.
+        self.stopping = False
+
+    # --- Admission ---
+    def _next_user(self) -> int:
+        # min() keeps the first of equals, i.e. arrival order.
+        return min(self.rotation, key=lambda user_id: self.served.get(user_id, 0))
+
+    def _dispatch(self):
+        while self.rotation and len(self.running) < self.max_running:
+            user_id = self._next_user()
+            job = self.queues[user_id][0]
+            if self.running and self.running_bytes + job.weight > self.memory_budget:
+                # Waiting here rather than skipping ahead keeps large jobs
+                # from starving.
+                break
+            self.rotation.remove(user_id)
+            self.queues[user_id].popleft()
+            if self.queues[user_id]:
+                self.rotation.append(user_id)
+            else:
+                del self.queues[user_id]
+            job.running = True
+            self.running.add(job)
+            self.served[user_id] = self.served.get(user_id, 0) + 1
+            self.running_bytes += job.weight
+            job.admitted.set_result(None)
+        if not self.running and not self.queues:
+            self.served.clear()
+
+    def _remove(self, job: Job):
+        queue = self.queues.get(job.user_id)
+        if queue is None or job not in queue:
+            return
+        queue.remove(job)
+        if not queue:
+            del self.queues[job.user_id]
+            self.rotation.remove(job.user_id)
+        self._dispatch()
+
+    def _release(self, job: Job):
+        self.running.discard(job)
+        self.running_bytes -= job.weight
+        self._dispatch()
+
+    def position(self, job: Job) -> int:
+        # 1-based place in the order the queued jobs will be admitted,
+        # assuming the running jobs finish in the meantime.
+        queues = {user_id: list(queue) for user_id, queue in self.queues.items()}
+        served = dict(self.served)
+        rotation = list(self.rotation)
+        place = 0
+        while rotation:
+            user_id = min(rotation, key=lambda u: served.get(u, 0))
+            place += 1
+            if queues[user_id].pop(0) is job:
+                return place
+            served[user_id] = served.get(user_id, 0) + 1
+            rotation.remove(user_id)
+            if queues[user_id]:
+                rotation.append(user_id)
+        return 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, weight: int,
+                   on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+        job = Job(user_id, weight, asyncio.get_running_loop().create_future())
+        self.queues.setdefault(user_id, deque()).append(job)
+        if user_id not in self.rotation:
+            self.rotation.append(user_id)
+        self._dispatch()
+        try:
+            if not job.running:
+                if on_queued is not None:
+                    await on_queued(self.position(job))
+                await job.admitted
+        except BaseException:
+            if job.running:
+                self._release(job)
+            else:
+                self._remove(job)
+            raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    # --- Jobs ---
+    def spawn(self, user_id: int, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        tasks = self.tasks.setdefault(user_id, set())
+        tasks.add(task)
+
+        def forget(done: asyncio.Task):
+            tasks.discard(done)
+            if not tasks and self.tasks.get(user_id) is tasks:
+                del self.tasks[user_id]
+        task.add_done_callback(forget)
+        return task
+
+    def cancel(self, user_id: int) -> int:
+        tasks = list(self.tasks.get(user_id, ()))
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    async def wait_idle(self):
+        while self.tasks:
+            await asyncio.gather(*[t for tasks in self.tasks.values() for t in tasks], return_exceptions=True)
+
+    async def shutdown(self):
+        self.stopping = True
+        for user_id in list(self.tasks):
+            self.cancel(user_id)
+        await self.wait_idle()
+
+    # --- Backpressure ---
+    # New files are refused while too many jobs wait. Holding back their
+    # downloads instead could stall admitted jobs waiting for their items.
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def saturated(self) -> bool:
+        return self.queued() >= self.max_queued
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": len(self.running), "queued": self.queued(), "running_bytes": self.running_bytes}
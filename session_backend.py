@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+# Both backends keep opaque byte records under string keys and offer a
+# transaction that serializes read-modify-write cycles. Callers pickle their
+# own values, so neither backend ever shares objects with its callers.
+
+class MemorySessionBackend:
+    # In-process stand-in for a single worker and for tests.
+    def __init__(self):
+        self.records: Dict[str, bytes] = {}
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            yield
+
+    def load(self, key: str) -> Optional[bytes]:
+        return self.records.get(key)
+
+    def save(self, key: str, value: bytes):
+        self.records[key] = value
+
+    def delete(self, key: str):
+        self.records.pop(key, None)
+
+    def keys(self, prefix: str) -> List[str]:
+        with self.lock:
+            return [key for key in self.records if key.startswith(prefix)]
+
+    def close(self):
+        pass
+
+class SqliteSessionBackend:
+    # Records in a SQLite file that every worker opens, e.g. on the same
+    # shared volume as the spool directory. Transactions take the write lock
+    # up front (BEGIN IMMEDIATE) so concurrent workers queue instead of
+    # failing on upgrade.
+    def __init__(self, path: str, timeout: float = 30):
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.depth = 0
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            outer = self.depth == 0
+            if outer:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if outer:
+                    self.conn.execute("ROLLBACK")
+                raise
+            self.depth -= 1
+            if outer:
+                self.conn.execute("COMMIT")
+
+    def load(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM records WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, key: str, value: bytes):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO records (key, value) VALUES (?, ?)", (key, value))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM records WHERE key = ?", (key,))
+
+    def keys(self, prefix: str) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT key FROM records WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff")
+            )]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def create_session_backend(name: str, path: str):
+    if name == "sqlite":
+        return SqliteSessionBackend(path)
+    return MemorySessionBackend()
@@ -0,0 +1,338 @@
+import asyncio
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from session_backend import MemorySessionBackend
+
+# --- Item payloads ---
+class Payload:
+    # Binary item content, in memory or in a file read back on demand.
+    # Session items always use files, see SessionStore._spool.
+    def __init__(self, data: bytes = None, path: str = None, size: int = 0):
+        self.data = data
+        self.path = path
+        self.size = size if path else len(data)
+
+    @property
+    def spooled(self) -> bool:
+        return self.path is not None
+
+    def open(self):
+        if self.path:
+            return open(self.path, "rb")
+        return BytesIO(self.data)
+
+    def getvalue(self) -> bytes:
+        if self.path:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self.data
+
+    def discard(self):
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.data = None
+        self.path = None
+
+class QuotaExceeded(Exception):
+    pass
+
+# --- Session store ---
+def payload_size(item: Dict[str, Any]) -> int:
+    return item["content"].size if isinstance(item["content"], Payload) else 0
+
+class SessionStore:
+    # Sessions are records in a session backend, so several workers can
+    # serve the same user; payload files live in the spool directory, which
+    # has to be shared between them too. Returned items and sessions are
+    # copies: changes are written back with update() and update_item().
+    # Items handed to a conversion move to a batch of their own until the
+    # conversion finishes. The worker running it refreshes the batch on every
+    # sweep; a batch not refreshed for batch_ttl belongs to a worker that
+    # stopped and goes back to the session.
+    def __init__(self, spool_dir: str, max_user_bytes: int, max_user_items: int, idle_ttl: float,
+                 backend=None, download_timeout: float = 120, batch_ttl: float = 30 * 60):
+        self.spool_dir = spool_dir
+        self.max_user_bytes = max_user_bytes
+        self.max_user_items = max_user_items
+        self.idle_ttl = idle_ttl
+        self.backend = backend if backend is not None else MemorySessionBackend()
+        self.download_timeout = download_timeout
+        self.batch_ttl = batch_ttl
+        # Downloads running in this worker by item id.
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # Batches taken by this worker and not finished yet.
+        self.worker_id = uuid.uuid4().hex
+        self.running: Set[str] = set()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    # --- Records ---
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"session:{user_id}"
+
+    def _load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        data = self.backend.load(self._key(user_id))
+        return pickle.loads(data) if data is not None else None
+
+    def _save(self, user_id: int, session: Dict[str, Any]):
+        self.backend.save(self._key(user_id), pickle.dumps(session, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _new_session() -> Dict[str, Any]:
+        return {"items": [], "batches": {}, "batch_owners": {}, "instruction_sent": False}
+
+    @contextmanager
+    def _edit(self, user_id: int):
+        # Only changes count as activity for evict_idle, reads do not.
+        with self.backend.transaction():
+            session = self._load(user_id) or self._new_session()
+            session.setdefault("batch_owners", {})
+            yield session
+            session["last_seen"] = time.time()
+            self._save(user_id, session)
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        # Read only, and no transaction: handlers call it for every message.
+        session = self._load(user_id)
+        if session is None:
+            return self._new_session()
+        session.setdefault("batch_owners", {})
+        return session
+
+    def update(self, user_id: int, **fields):
+        with self._edit(user_id) as session:
+            session.update(fields)
+
+    def items(self, user_id: int) -> List[Dict[str, Any]]:
+        session = self._load(user_id)
+        return session["items"] if session else []
+
+    def check_quota(self, user_id: int, size: int = 0, session: Dict[str, Any] = None):
+        session = session if session is not None else self._load(user_id) or {"items": []}
+        if len(session["items"]) >= self.max_user_items:
+            raise QuotaExceeded(f"item limit {self.max_user_items}")
+        if sum(payload_size(item) for item in session["items"]) + size > self.max_user_bytes:
+            raise QuotaExceeded(f"size limit {self.max_user_bytes}")
+
+    def _spool(self, data: bytes) -> Payload:
+        # Every access loads and saves the whole record, so it only holds
+        # metadata; even small payloads such as pre-rendered pages are files.
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=".item")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return Payload(path=path, size=len(data))
+
+    def _append(self, user_id: int, item: Dict[str, Any], size: int) -> Dict[str, Any]:
+        try:
+            with self._edit(user_id) as session:
+                self.check_quota(user_id, size, session)
+                session["items"].append(item)
+        except QuotaExceeded:
+            self.discard_items([item])
+            raise
+        return item
+
+    def add_item(self, user_id: int, item_type: str, content, **meta) -> Dict[str, Any]:
+        size = len(content) if isinstance(content, bytes) else 0
+        self.check_quota(user_id, size)
+        if isinstance(content, bytes):
+            content = self._spool(content)
+        item = {"id": uuid.uuid4().hex, "type": item_type, "content": content, **meta}
+        return self._append(user_id, item, size)
+
+    def _reserve(self, item_type: str, size: int, suffix: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=suffix)
+        os.close(fd)
+        return {"id": uuid.uuid4().hex, "type": item_type, "content": Payload(path=path, size=size),
+                "pending": True, **meta}
+
+    def add_file(self, user_id: int, item_type: str, size: int, suffix: str = "", **meta) -> Dict[str, Any]:
+        # Reserves a spool file that the caller downloads into. The item is
+        # in the session right away, so its position follows arrival order;
+        # it stays pending until the download is written back.
+        self.check_quota(user_id, size)
+        return self._append(user_id, self._reserve(item_type, size, suffix, meta), size)
+
+    def add_files(self, user_id: int, files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # add_file for several files in one write, e.g. an album; each file
+        # is add_file's arguments as a dict. Files are taken in order until
+        # the quota is reached; returns those taken.
+        items = []
+        with self._edit(user_id) as session:
+            for spec in files:
+                meta = dict(spec)
+                item_type, size, suffix = meta.pop("item_type"), meta.pop("size"), meta.pop("suffix", "")
+                try:
+                    self.check_quota(user_id, size, session)
+                except QuotaExceeded:
+                    break
+                item = self._reserve(item_type, size, suffix, meta)
+                session["items"].append(item)
+                items.append(item)
+        return items
+
+    def track(self, item: Dict[str, Any], task: asyncio.Task):
+        self.tasks[item["id"]] = task
+        task.add_done_callback(lambda _: self.tasks.pop(item["id"], None))
+
+    def update_item(self, user_id: int, item: Dict[str, Any]) -> bool:
+        # Writes back an item wherever it is now, in the session or in a
+        # batch. An item that is gone was cancelled, so its files go too.
+        with self._edit(user_id) as session:
+            for items in [session["items"], *session["batches"].values()]:
+                for i, current in enumerate(items):
+                    if current["id"] == item["id"]:
+                        items[i] = item
+                        return True
+        self.discard_items([item])
+        return False
+
+    def attach_render(self, user_id: int, item: Dict[str, Any], key, data: Optional[bytes], size, display):
+        # Pre-rendered page content, kept next to the item until the session
+        # is cleared. No data means the source is used as it is.
+        payload = self._spool(data) if data is not None else None
+        item.setdefault("rendered", {})[key] = (payload, size, display)
+        self.update_item(user_id, item)
+
+    # --- Conversion batches ---
+    def take_items(self, user_id: int) -> Tuple[str, List[Dict[str, Any]]]:
+        # Hands the items over to a conversion; anything sent from now on
+        # starts a new batch.
+        with self._edit(user_id) as session:
+            items, session["items"] = session["items"], []
+            batch_id = uuid.uuid4().hex
+            if items:
+                session["batches"][batch_id] = items
+                now = time.time()
+                session["batch_owners"][batch_id] = {"worker": self.worker_id, "taken_at": now, "seen_at": now}
+                self.running.add(batch_id)
+        return batch_id, items
+
+    def batch(self, user_id: int, batch_id: str) -> Optional[List[Dict[str, Any]]]:
+        session = self._load(user_id)
+        return session["batches"].get(batch_id) if session else None
+
+    async def wait_batch(self, user_id: int, batch_id: str, poll: float = 0.5) -> Optional[List[Dict[str, Any]]]:
+        # Returns the batch once no item is pending. Downloads running here
+        # are awaited, those of other workers are polled for.
+        deadline = time.monotonic() + self.download_timeout
+        while True:
+            items = self.batch(user_id, batch_id)
+            pending = [item for item in items or [] if item.get("pending")]
+            if not pending:
+                return items
+            if time.monotonic() > deadline:
+                for item in pending:
+                    item["error"] = "download timed out"
+                return items
+            tasks = [self.tasks[item["id"]] for item in pending if item["id"] in self.tasks]
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            else:
+                await asyncio.sleep(poll)
+
+    @staticmethod
+    def _pop_batch(session: Dict[str, Any], batch_id: str) -> List[Dict[str, Any]]:
+        session["batch_owners"].pop(batch_id, None)
+        return session["batches"].pop(batch_id, [])
+
+    def restore_batch(self, user_id: int, batch_id: str):
+        # Puts the items of a conversion that did not finish back in front.
+        self.running.discard(batch_id)
+        with self._edit(user_id) as session:
+            session["items"] = self._pop_batch(session, batch_id) + session["items"]
+
+    def finish_batch(self, user_id: int, batch_id: str):
+        self.running.discard(batch_id)
+        with self._edit(user_id) as session:
+            items = self._pop_batch(session, batch_id)
+        self.discard_items(items)
+
+    def sweep_batches(self, user_id: int, now: Optional[float] = None) -> int:
+        # Refreshes the batches running here and restores those whose worker
+        # is gone: taken by this worker but no longer running, or not
+        # refreshed by another one for batch_ttl. Returns how many were
+        # restored.
+        now = time.time() if now is None else now
+        with self._edit(user_id) as session:
+            stale = []
+            for batch_id in list(session["batches"]):
+                owner = session["batch_owners"].get(batch_id)
+                if batch_id in self.running:
+                    owner["seen_at"] = now
+                elif owner is None or owner["worker"] == self.worker_id or now - owner["seen_at"] > self.batch_ttl:
+                    stale.append(batch_id)
+            for batch_id in stale:
+                session["items"] = self._pop_batch(session, batch_id) + session["items"]
+        return len(stale)
+
+    # --- Cleanup ---
+    def discard_items(self, items: List[Dict[str, Any]]):
+        for item in items:
+            task = self.tasks.pop(item.get("id"), None)
+            if task is not None:
+                task.cancel()
+            if isinstance(item["content"], Payload):
+                item["content"].discard()
+            for payload, _, _ in item.get("rendered", {}).values():
+                if payload is not None:
+                    payload.discard()
+
+    def clear_items(self, user_id: int):
+        with self._edit(user_id) as session:
+            items, session["items"] = session["items"], []
+        self.discard_items(items)
+
+    def drop(self, user_id: int):
+        with self.backend.transaction():
+            session = self._load(user_id)
+            self.backend.delete(self._key(user_id))
+        if session is not None:
+            self.discard_items(session["items"] + [i for items in session["batches"].values() for i in items])
+
+    def _sessions(self):
+        for key in self.backend.keys("session:"):
+            data = self.backend.load(key)
+            if data is not None:
+                yield int(key.split(":", 1)[1]), pickle.loads(data)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        for uid in [uid for uid, s in self._sessions() if s["batches"]]:
+            self.sweep_batches(uid, now)
+        idle = [uid for uid, s in self._sessions() if now - s["last_seen"] > self.idle_ttl and not s["batches"]]
+        for uid in idle:
+            self.drop(uid)
+        return len(idle)
+
+    def stats(self) -> Dict[str, int]:
+        sessions = resident = spooled = items = pending = 0
+        for _, session in self._sessions():
+            sessions += 1
+            for item in session["items"] + [i for batch in session["batches"].values() for i in batch]:
+                items += 1
+                if item.get("pending"):
+                    pending += 1
+                content = item["content"]
+                payloads = [content] + [p for p, _, _ in item.get("rendered", {}).values() if p is not None]
+                for payload in payloads:
+                    if not isinstance(payload, Payload):
+                        continue
+                    if payload.spooled:
+                        spooled += payload.size
+                    else:
+                        resident += payload.size
+                if isinstance(content, str):
+                    resident += len(content.encode("utf-8"))
+        return {"sessions": sessions, "items": items, "pending": pending,
+                "resident_bytes": resident, "spooled_bytes": spooled}
@@ -0,0 +1,116 @@
+from io import BytesIO
+from typing import Dict, Any, List, Tuple
+
+from page_layout import fit_to_page, page_range
+
+# Lower steps are only used when the session would not fit otherwise.
+RENDER_STEPS = [(150, 90), (150, 80), (120, 75), (100, 70), (85, 60), (72, 50)]
+MAX_RENDER_ATTEMPTS = 3
+# The estimate is rough, so the lowest step has to miss the budget by this
+# much before the session is refused without rendering.
+ABORT_MARGIN = 1.25
+# Output volumes are planned to this share of the size cap; the estimate per
+# page is rough and a volume over the cap is split again.
+VOLUME_FILL = 0.9
+
+PAGE_OVERHEAD = 1500
+FONT_OVERHEAD = 60 * 1024
+TEXT_BYTES_PER_CHAR = 1.2
+
+# Bytes per pixel of a baseline JPEG of photographic content by quality.
+JPEG_BPP = [(40, 0.10), (50, 0.12), (60, 0.14), (70, 0.17), (75, 0.19), (80, 0.22),
+            (85, 0.26), (90, 0.32), (95, 0.45), (100, 0.90)]
+
+Step = Tuple[int, int, int]
+
+# --- Estimation ---
+def jpeg_bytes_per_pixel(quality: int) -> float:
+    if quality <= JPEG_BPP[0][0]:
+        return JPEG_BPP[0][1]
+    for (q0, b0), (q1, b1) in zip(JPEG_BPP, JPEG_BPP[1:]):
+        if quality <= q1:
+            return b0 + (b1 - b0) * (quality - q0) / (q1 - q0)
+    return JPEG_BPP[-1][1]
+
+def content_size(content) -> int:
+    if isinstance(content, BytesIO):
+        return content.getbuffer().nbytes
+    return content.size
+
+def estimate_photo(item: Dict[str, Any], dpi: int, quality: int) -> int:
+    size = content_size(item["content"])
+    width, height = item.get("width"), item.get("height")
+    if not width or not height:
+        return size + PAGE_OVERHEAD
+    display = fit_to_page(width, height)
+    target = (max(1, round(display[0] * dpi / 72)), max(1, round(display[1] * dpi / 72)))
+    if item.get("format") == "JPEG" and width <= target[0] and height <= target[1]:
+        # Embedded unchanged, see prepare_photo.
+        return size + PAGE_OVERHEAD
+    pixels = min(width, target[0]) * min(height, target[1])
+    complexity = 1.0
+    if item.get("format") == "JPEG":
+        # Noisy sources stay noisy after resampling; compare the source with
+        # a typical photo at quality 90.
+        source_bpp = size / (width * height)
+        complexity = min(2.0, max(0.3, source_bpp / jpeg_bytes_per_pixel(90)))
+    return int(pixels * jpeg_bytes_per_pixel(quality) * complexity) + PAGE_OVERHEAD
+
+def estimate_pdf(item: Dict[str, Any]) -> int:
+    size = content_size(item["content"])
+    page_count = item.get("page_count")
+    if not page_count:
+        return size
+    from_page, to_page = page_range(item)
+    pages = max(0, to_page - from_page + 1)
+    return int(size * pages / page_count) + PAGE_OVERHEAD * pages
+
+def estimate_item(item: Dict[str, Any], dpi: int, quality: int) -> int:
+    if item["type"] == "text":
+        return int(len(item["content"]) * TEXT_BYTES_PER_CHAR)
+    if item["type"] == "pdf":
+        return estimate_pdf(item)
+    return estimate_photo(item, dpi, quality)
+
+def estimate_output(items: List[Dict[str, Any]], dpi: int, quality: int) -> int:
+    total = sum(estimate_item(item, dpi, quality) for item in items)
+    if any(item["type"] == "text" for item in items):
+        total += FONT_OVERHEAD
+    return total
+
+# --- Planning ---
+def render_steps(dpi: int, quality: int) -> List[Tuple[int, int]]:
+    steps = [(dpi, quality)]
+    steps += [(d, q) for d, q in RENDER_STEPS if d <= dpi and q <= quality and (d, q) != (dpi, quality)]
+    return steps
+
+def plan_render(items: List[Dict[str, Any]], budget: int, dpi: int, quality: int) -> List[Step]:
+    # Returns (dpi, quality, estimate) from the first step expected to fit
+    # downwards, or an empty list when the session cannot fit at all.
+    estimates = [(d, q, estimate_output(items, d, q)) for d, q in render_steps(dpi, quality)]
+    if estimates[-1][2] > budget * ABORT_MARGIN:
+        return []
+    for i, (_, _, estimate) in enumerate(estimates):
+        if estimate <= budget:
+            return estimates[i:]
+    return estimates[-1:]
+
+async def render_within_budget(render, items: List[Dict[str, Any]], budget: int, steps: List[Step]):
+    # Renders at the planned step and only steps down when the output still
+    # misses the budget. Later steps are skipped when the estimate, corrected
+    # by how far off the last one was, would not fit either.
+    result = None
+    correction = 1.0
+    attempts = 0
+    for dpi, quality, estimate in steps:
+        if result is not None and estimate * correction > budget and (dpi, quality, estimate) != steps[-1]:
+            continue
+        result = await render(items, dpi, quality)
+        attempts += 1
+        size = result[0]
+        if size is None:
+            return result
+        if size <= budget or attempts >= MAX_RENDER_ATTEMPTS:
+            return result
+        correction = size / max(estimate, 1)
+    return result
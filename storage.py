@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    admin_chat_id INTEGER NOT NULL,
+    from_chat_id INTEGER,
+    message_id INTEGER,
+    text TEXT,
+    status TEXT NOT NULL DEFAULT 'running',
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    broadcast_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (broadcast_id, user_id)
+);
+"""
+
+class Storage:
+    # Users and counters live in SQLite (WAL mode). Languages are cached in
+    # process and counter increments are buffered until flush(). Workers
+    # sharing the database see each other's language changes once their
+    # cached entry is older than lang_ttl seconds; None caches for good.
+    # Blocked users are kept in memory as well, so updates from everyone
+    # else never touch the database.
+    def __init__(self, path: str, lang_ttl: Optional[float] = None):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.lang_ttl = lang_ttl
+        # user_id -> (lang or None for unknown users, when it was read)
+        self.lang_cache: Dict[int, Tuple[Optional[str], float]] = {}
+        self.pending: Dict[str, int] = defaultdict(int)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(users)")]
+            if "blocked" not in columns:
+                self.conn.execute("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0")
+            rows = self.conn.execute("SELECT user_id FROM users WHERE blocked = 1")
+            self.blocked: Set[int] = {row[0] for row in rows}
+
+    # --- Migration ---
+    def migrate_json(self, users_file: str, stats_file: str):
+        with self.lock:
+            done = self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done:
+                return
+            users, stats = {}, {}
+            try:
+                if os.path.exists(users_file):
+                    with open(users_file, "r") as f:
+                        users = json.load(f)
+            except Exception:
+                users = {}
+            try:
+                if os.path.exists(stats_file):
+                    with open(stats_file, "r") as f:
+                        stats = json.load(f)
+            except Exception:
+                stats = {}
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, lang, created_at) VALUES (?, ?, ?)",
+                    [(int(uid), lang, now) for uid, lang in users.items()]
+                )
+                self.conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    [(name, int(value)) for name, value in stats.items()]
+                )
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    # --- Users ---
+    def _cached_lang(self, user_id: int) -> Tuple[bool, Optional[str]]:
+        cached = self.lang_cache.get(user_id)
+        if cached is None:
+            return False, None
+        lang, read_at = cached
+        if self.lang_ttl is not None and time.monotonic() - read_at > self.lang_ttl:
+            del self.lang_cache[user_id]
+            return False, None
+        return True, lang
+
+    def get_lang(self, user_id: int, default: str) -> str:
+        found, lang = self._cached_lang(user_id)
+        if not found:
+            with self.lock:
+                row = self.conn.execute("SELECT lang FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            lang = row[0] if row else None
+            self.lang_cache[user_id] = (lang, time.monotonic())
+        return lang or default
+
+    def set_lang(self, user_id: int, lang: str):
+        if self._cached_lang(user_id) == (True, lang):
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO users (user_id, lang, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET lang = excluded.lang",
+                (user_id, lang, time.time())
+            )
+        self.lang_cache[user_id] = (lang, time.monotonic())
+
+    def user_count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def user_ids(self) -> List[int]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+
+    def mark_blocked(self, user_id: int):
+        with self.lock:
+            self.conn.execute("UPDATE users SET blocked = 1 WHERE user_id = ?", (user_id,))
+            self.blocked.add(user_id)
+
+    def mark_active(self, user_id: int):
+        # A user who writes again has unblocked the bot.
+        if user_id not in self.blocked:
+            return
+        with self.lock:
+            self.conn.execute("UPDATE users SET blocked = 0 WHERE user_id = ?", (user_id,))
+            self.blocked.discard(user_id)
+
+    # --- Broadcasts ---
+    def create_broadcast(self, kind: str, admin_chat_id: int, text: str = None,
+                         from_chat_id: int = None, message_id: int = None) -> int:
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO broadcasts (kind, admin_chat_id, from_chat_id, message_id, text, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, admin_chat_id, from_chat_id, message_id, text, time.time())
+            )
+            return cur.lastrowid
+
+    def get_broadcast(self, broadcast_id: int) -> Dict[str, Any]:
+        with self.lock:
+            cur = self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            row = cur.fetchone()
+            return dict(zip([c[0] for c in cur.description], row)) if row else None
+
+    def unfinished_broadcasts(self) -> List[int]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")]
+
+    def broadcast_recipients(self, broadcast_id: int) -> List[int]:
+        # Users that are not blocked and have not been handled by this broadcast yet.
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT user_id FROM users WHERE blocked = 0 AND user_id NOT IN "
+                "(SELECT user_id FROM broadcast_deliveries WHERE broadcast_id = ?) ORDER BY user_id",
+                (broadcast_id,)
+            )]
+
+    def record_delivery(self, broadcast_id: int, user_id: int, status: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+                (broadcast_id, user_id, status)
+            )
+
+    def broadcast_summary(self, broadcast_id: int) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,)
+            ).fetchall())
+
+    def finish_broadcast(self, broadcast_id: int):
+        with self.lock:
+            self.conn.execute("UPDATE broadcasts SET status = 'done' WHERE id = ?", (broadcast_id,))
+
+    # --- Counters ---
+    def incr(self, name: str, amount: int = 1):
+        self.pending[name] += amount
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, defaultdict(int)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(pending.items())
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                for name, amount in pending.items():
+                    self.pending[name] += amount
+                raise
+
+    def counters(self) -> Dict[str, int]:
+        with self.lock:
+            values = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+        for name, amount in self.pending.items():
+            values[name] = values.get(name, 0) + amount
+        return values
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
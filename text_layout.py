@@ -0,0 +1,127 @@
+from typing import Dict, List
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+
+# --- Glyph metrics ---
+class GlyphWidths:
+    # Advance widths at size 1, measured once per glyph with stringWidth.
+    def __init__(self, font_name: str):
+        self.font_name = font_name
+        self.widths: Dict[str, float] = {}
+
+    def char(self, ch: str) -> float:
+        width = self.widths.get(ch)
+        if width is None:
+            width = pdfmetrics.stringWidth(ch, self.font_name, 1)
+            self.widths[ch] = width
+        return width
+
+    def text(self, text: str) -> float:
+        char = self.char
+        return sum(char(ch) for ch in text)
+
+_glyph_widths: Dict[str, GlyphWidths] = {}
+
+def glyph_widths(font_name: str) -> GlyphWidths:
+    widths = _glyph_widths.get(font_name)
+    if widths is None:
+        widths = _glyph_widths[font_name] = GlyphWidths(font_name)
+    return widths
+
+# --- Line breaking ---
+def wrap_text(text: str, widths: GlyphWidths, font_size: float, max_width: float) -> List[str]:
+    # Greedy word wrap on measured widths. Every word is measured once and
+    # words wider than a line are split by glyph, so the cost stays linear
+    # in the length of the text. Blank lines are kept.
+    limit = max_width / font_size
+    space = widths.char(" ")
+    lines = []
+    for paragraph in text.expandtabs(4).split("\n"):
+        current: List[str] = []
+        current_width = 0.0
+        for word in paragraph.split(" "):
+            if not word:
+                continue
+            word_width = widths.text(word)
+            if word_width > limit:
+                if current:
+                    lines.append(" ".join(current))
+                    current, current_width = [], 0.0
+                piece, piece_width = [], 0.0
+                for ch in word:
+                    ch_width = widths.char(ch)
+                    if piece and piece_width + ch_width > limit:
+                        lines.append("".join(piece))
+                        piece, piece_width = [], 0.0
+                    piece.append(ch)
+                    piece_width += ch_width
+                current, current_width = ["".join(piece)], piece_width
+                continue
+            needed = word_width + (space if current else 0.0)
+            if current and current_width + needed > limit:
+                lines.append(" ".join(current))
+                current, current_width = [word], word_width
+            else:
+                current.append(word)
+                current_width += needed
+        lines.append(" ".join(current))
+    return lines
+
+# --- Text flow ---
+class TextFlow:
+    # Flows consecutive text items down shared pages, separated by
+    # paragraph spacing. A page is only finished when the next line does not
+    # fit or when close() is called before a non-text item.
+    def __init__(self, c: canvas.Canvas, font_name: str, font_size: float, margin: float = 40,
+                 top: float = 50, bottom: float = 50, line_height: float = 20,
+                 paragraph_spacing: float = 10):
+        self.canvas = c
+        self.font_name = font_name
+        self.font_size = font_size
+        self.widths = glyph_widths(font_name)
+        self.left = margin
+        self.max_width = A4[0] - 2 * margin
+        self.top = A4[1] - top
+        self.bottom = bottom
+        self.line_height = line_height
+        self.paragraph_spacing = paragraph_spacing
+        self.text = None
+        self.y = None
+
+    def _new_page(self):
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        self.text = self.canvas.beginText()
+        self.text.setFont(self.font_name, self.font_size)
+        self.y = self.top
+
+    def add(self, content: str):
+        lines = wrap_text(content, self.widths, self.font_size, self.max_width)
+        # Leading and trailing blank lines would only add empty space.
+        while lines and not lines[-1]:
+            lines.pop()
+        while lines and not lines[0]:
+            lines.pop(0)
+        if not lines:
+            return
+        if self.text is None:
+            self._new_page()
+        elif self.y != self.top:
+            self.y -= self.paragraph_spacing
+        for line in lines:
+            if self.y < self.bottom:
+                self._new_page()
+            if line:
+                self.text.setTextOrigin(self.left, self.y)
+                self.text.textOut(line)
+            self.y -= self.line_height
+
+    def close(self):
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        self.text = None
+        self.y = None
@@ -0,0 +1,41 @@
+import os
+from typing import Dict, Any
+
+import httpx
+from telegram.error import RetryAfter, TelegramError
+
+class Uploader:
+    # Sends documents from disk with a streamed multipart body. Bot's own
+    # send_document reads the whole file into memory first.
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.client = None
+
+    async def send_document(self, bot, chat_id: int, path: str, filename: str, caption: str = None) -> Dict[str, Any]:
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout, connect=10))
+        data = {"chat_id": str(chat_id)}
+        if caption:
+            data["caption"] = caption
+        with open(path, "rb") as f:
+            response = await self.client.post(
+                f"{bot.base_url}/sendDocument",
+                data=data,
+                files={"document": (os.path.basename(filename), f, "application/pdf")}
+            )
+        try:
+            result = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise TelegramError(f"Invalid response: {response.status_code}")
+        if not result.get("ok"):
+            retry_after = result.get("parameters", {}).get("retry_after")
+            if retry_after:
+                raise RetryAfter(retry_after)
+            raise TelegramError(result.get("description", "Unknown error"))
+        return result["result"]
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,105 @@
+import asyncio
+import hmac
+import json
+from typing import Any, Dict, Optional
+
+from telegram import Update
+
+MAX_BODY = 1024 * 1024
+ATTACH_TIMEOUT = 30
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+class WebhookServer:
+    # A minimal webhook endpoint that can listen before the application is
+    # initialized: PTB's run_webhook binds only after initialize() and its
+    # getMe round trip. Any GET is answered at once as a health check. An
+    # update is acknowledged only once it is in the application's queue, so
+    # until attach() the request is held, and answered with 503 when the
+    # application does not come up in time or the server closes first;
+    # Telegram then sends the update again.
+    def __init__(self, path: str, secret_token: Optional[str] = None):
+        self.path = path
+        self.secret_token = secret_token
+        self.application = None
+        self.ready = asyncio.Event()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.held = 0
+
+    async def start(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    def attach(self, application):
+        self.application = application
+        self.ready.set()
+
+    def pending(self) -> int:
+        return self.held
+
+    async def _wait_ready(self) -> bool:
+        if not self.ready.is_set():
+            self.held += 1
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout=ATTACH_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.held -= 1
+        return self.application is not None
+
+    async def _accept(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> str:
+        if method == "GET":
+            return "200 OK"
+        if method != "POST" or path.split("?")[0] != self.path:
+            return "404 Not Found"
+        if self.secret_token is not None and not hmac.compare_digest(
+                headers.get(SECRET_HEADER, ""), self.secret_token):
+            return "403 Forbidden"
+        try:
+            data: Any = json.loads(body)
+        except ValueError:
+            return "400 Bad Request"
+        if not await self._wait_ready():
+            return "503 Service Unavailable"
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except Exception:
+            # Sending it again would not help.
+            return "200 OK"
+        await self.application.update_queue.put(update)
+        return "200 OK"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+            lines = head.decode("latin-1").split("\r\n")
+            parts = lines[0].split(" ")
+            method, path = (parts[0], parts[1]) if len(parts) >= 2 else ("", "")
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0) or 0)
+            if length > MAX_BODY:
+                status = "413 Payload Too Large"
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+                status = await self._accept(method, path, headers, body)
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        # Held requests are answered with 503 if the application never
+        # attached.
+        self.ready.set()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None